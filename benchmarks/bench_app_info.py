@@ -0,0 +1,138 @@
+# coding: utf-8
+"""Benchmark the I/O done by the QuantLab extension commands.
+
+Compares the lazily computed app info against computing every field up
+front, which is what the handler used to do on construction.
+
+    python benchmarks/bench_app_info.py [number of extensions]
+"""
+
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+from __future__ import print_function
+
+import io
+import json
+import os
+import os.path as osp
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+
+sys.path.insert(0, osp.join(osp.dirname(osp.abspath(__file__)), '..'))
+
+from quantlab import commands  # noqa
+
+
+def make_extension(path, name):
+    """Write a minimal extension tarball to a path.
+    """
+    data = dict(name=name, version='0.1.0', quantlab=dict(extension=True))
+    files = {
+        'package/package.json': json.dumps(data).encode('utf8'),
+        'package/index.js': b'module.exports = [];'
+    }
+    with tarfile.open(path, 'w:gz') as tar:
+        for (fname, content) in sorted(files.items()):
+            info = tarfile.TarInfo(fname)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+
+
+class IOCounter(object):
+    """Count the files opened by the commands module.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.tarballs = 0
+
+    def __enter__(self):
+        self._open = open
+        self._tar_open = tarfile.open
+
+        def counted_open(*args, **kwargs):
+            self.files += 1
+            return self._open(*args, **kwargs)
+
+        def counted_tar_open(*args, **kwargs):
+            self.tarballs += 1
+            return self._tar_open(*args, **kwargs)
+
+        commands.open = counted_open
+        tarfile.open = counted_tar_open
+        return self
+
+    def __exit__(self, *args):
+        del commands.open
+        tarfile.open = self._tar_open
+
+
+def run(name, func, app_dir, eager):
+    """Run a command and report the I/O it performed.
+    """
+    get_app_info = commands._AppHandler._get_app_info
+
+    def get_eager_info(handler):
+        info = get_app_info(handler)
+        info.load()
+        return info
+
+    if eager:
+        commands._AppHandler._get_app_info = get_eager_info
+    try:
+        with IOCounter() as counter:
+            t0 = time.time()
+            func(app_dir)
+            elapsed = time.time() - t0
+    finally:
+        commands._AppHandler._get_app_info = get_app_info
+
+    mode = 'eager' if eager else 'lazy'
+    print('%-20s %-6s %6d %9d %10.1f' % (
+        name, mode, counter.files, counter.tarballs, elapsed * 1000
+    ))
+
+
+def main(count=200):
+    app_dir = tempfile.mkdtemp(prefix='quantlab-bench')
+    try:
+        for dname in ['extensions', 'settings', 'staging']:
+            os.makedirs(osp.join(app_dir, dname))
+        for i in range(count):
+            path = osp.join(app_dir, 'extensions', 'ext%s-0.1.0.tgz' % i)
+            make_extension(path, 'ext%s' % i)
+
+        cmds = [
+            ('enable_extension',
+             lambda d: commands.enable_extension('ext1', d)),
+            ('disable_extension',
+             lambda d: commands.disable_extension('ext1', d)),
+            ('uninstall (core)',
+             lambda d: commands.uninstall_extension(
+                 '@quantlab/console-extension', d)),
+            ('build_check',
+             lambda d: commands.build_check(d)),
+            ('get_app_info',
+             lambda d: commands.get_app_info(d)),
+        ]
+
+        print('%d extensions' % count)
+        print('%-20s %-6s %6s %9s %10s' % (
+            'command', 'mode', 'files', 'tarballs', 'time (ms)'
+        ))
+        index = osp.join(app_dir, 'settings', 'extension_index.json')
+        for (name, func) in cmds:
+            for eager in [True, False]:
+                # Start from a cold extension index.
+                if osp.exists(index):
+                    os.remove(index)
+                run(name, func, app_dir, eager)
+    finally:
+        shutil.rmtree(app_dir)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,185 @@
+# coding: utf-8
+"""Benchmark parsing of repeated semver specs and range resolution.
+
+Checks every singleton package spec of the core data against itself,
+the way the compatibility validation of many extensions does, with and
+without the semver parse caches.  Then resolves ranges against a long
+list of versions by testing the comparators of each version and with
+the compiled intervals of the ranges.  Last, sorts many versions by
+comparing their identifiers and by the precomputed version keys.
+
+    python benchmarks/bench_semver.py [number of repeats]
+"""
+
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+from __future__ import print_function
+
+import functools
+import os.path as osp
+import random
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+sys.path.insert(0, osp.join(osp.dirname(osp.abspath(__file__)), '..'))
+
+from quantlab import commands, semver  # noqa
+
+
+def clear_caches():
+    """Clear the semver parse caches.
+    """
+    for cache in [semver._semver_cache, semver._comparator_cache,
+                  semver._range_cache]:
+        cache.clear()
+
+
+def run(name, specs, repeats, cached):
+    """Test the overlap and format the ranges of the specs.
+    """
+    t0 = time.time()
+    for _ in range(repeats):
+        for spec in specs:
+            if not cached:
+                clear_caches()
+            commands._test_overlap(spec, spec)
+            str(semver.make_range(spec, True))
+    elapsed = time.time() - t0
+
+    mode = 'cached' if cached else 'parsed'
+    count = repeats * len(specs)
+    print('%-12s %-7s %8d %10.1f %10.2f' % (
+        name, mode, count, elapsed * 1000, elapsed * 1e6 / count
+    ))
+
+
+def max_satisfying_by_comparators(versions, spec):
+    """Resolve a range by testing every version against its comparators.
+    """
+    range_ = semver.make_range(spec, True)
+    selected = None
+    for version in versions:
+        if not any(semver.test_set(comps, version) for comps in range_.set):
+            continue
+        if selected is None or semver.gt(version, selected, True):
+            selected = version
+    return selected
+
+
+def run_resolve(specs, versions, compiled):
+    """Resolve the specs against the versions.
+    """
+    t0 = time.time()
+    for spec in specs:
+        if compiled:
+            semver.max_satisfying(versions, spec, True)
+        else:
+            max_satisfying_by_comparators(versions, spec)
+    elapsed = time.time() - t0
+
+    mode = 'compiled' if compiled else 'tested'
+    print('%-12s %-8s %8d %10.1f' % (
+        'resolve', mode, len(versions), elapsed * 1000
+    ))
+
+
+def compare_by_identifiers(a, b):
+    """Compare two parsed versions identifier by identifier.
+    """
+    for (x, y) in [(a.major, b.major), (a.minor, b.minor),
+                   (a.patch, b.patch)]:
+        result = semver.compare_identifiers(str(x), str(y))
+        if result:
+            return result
+    if not a.prerelease or not b.prerelease:
+        return len(b.prerelease) - len(a.prerelease) and (
+            1 if not a.prerelease else -1)
+    for (x, y) in zip(a.prerelease, b.prerelease):
+        if x != y:
+            return semver.compare_identifiers(str(x), str(y))
+    return len(a.prerelease) - len(b.prerelease)
+
+
+def run_parse(versions):
+    """Parse the versions, tracing the memory of the parsed objects.
+    """
+    clear_caches()
+    if tracemalloc:
+        tracemalloc.start()
+    t0 = time.time()
+    parsed = [semver.SemVer(version, True) for version in versions]
+    elapsed = time.time() - t0
+    peak = 0
+    if tracemalloc:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    print('%-12s %-8s %8d %10.1f %10.1f' % (
+        'parse', '', len(versions), elapsed * 1000, peak / 1e6
+    ))
+    return parsed
+
+
+def run_sort(parsed, keyed):
+    """Sort the parsed versions.
+    """
+    t0 = time.time()
+    if keyed:
+        sorted(parsed, key=lambda v: v.key)
+    else:
+        sorted(parsed, key=functools.cmp_to_key(compare_by_identifiers))
+    elapsed = time.time() - t0
+
+    mode = 'keyed' if keyed else 'compared'
+    print('%-12s %-8s %8d %10.1f' % (
+        'sort', mode, len(parsed), elapsed * 1000
+    ))
+
+
+def main(repeats=100):
+    core_data = commands._get_core_data()
+    deps = core_data['dependencies']
+    specs = [deps[name] for name in core_data['quantlab']['singletonPackages']
+             if name in deps]
+    specs += ['^1.2.3', '~0.14.0', '>=0.13.0 <0.14.0', '1.2.3 - 2.3.4']
+
+    print('%d specs, %d repeats' % (len(specs), repeats))
+    print('%-12s %-7s %8s %10s %10s' % (
+        'benchmark', 'mode', 'checks', 'time (ms)', 'us/check'
+    ))
+    for cached in [False, True]:
+        clear_caches()
+        run('overlap', specs, repeats, cached)
+
+    versions = ['%d.%d.%d' % (major, minor, patch)
+                for major in range(4) for minor in range(25)
+                for patch in range(20)]
+    print('')
+    print('%d specs, %d versions' % (len(specs), len(versions)))
+    print('%-12s %-8s %8s %10s' % ('benchmark', 'mode', 'versions',
+                                   'time (ms)'))
+    for compiled in [False, True]:
+        run_resolve(specs, versions, compiled)
+
+    rand = random.Random(0)
+    prereleases = ['alpha', 'beta.1', 'rc.2', '0', '1.x']
+    versions = []
+    for _ in range(100000):
+        version = '%d.%d.%d' % tuple(rand.randint(0, 20) for _ in range(3))
+        if rand.random() < 0.3:
+            version += '-' + rand.choice(prereleases)
+        versions.append(version)
+    print('')
+    print('%-12s %-8s %8s %10s %10s' % ('benchmark', 'mode', 'versions',
+                                        'time (ms)', 'peak (MB)'))
+    parsed = run_parse(versions)
+    for keyed in [False, True]:
+        run_sort(parsed, keyed)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
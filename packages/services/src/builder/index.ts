@@ -14,6 +14,16 @@ import {
  */
 const BUILD_SETTINGS_URL = 'quantlab/api/build';
 
+/**
+ * The url for the lab build events.
+ */
+const BUILD_EVENTS_URL = 'quantlab/api/build/events';
+
+/**
+ * The message of a failed build.
+ */
+const BUILD_FAILED_MESSAGE = 'Build failed, please run `jupyter quantlab build` on the server for full output';
+
 
 /**
  * The static namespace for `BuildManager`.
@@ -78,27 +88,42 @@ class BuildManager {
 
   /**
    * Build the application.
+   *
+   * #### Notes
+   * The build is followed with the build events, and the promise resolves
+   * when the build finishes.
    */
   build(): Promise<void> {
     const base = this.serverSettings.baseUrl;
     const url = URLExt.join(base, BUILD_SETTINGS_URL);
     const request = { method: 'POST', url, contentType: 'application/json' };
     const { serverSettings } = this;
-    const promise = ServerConnection.makeRequest(request, serverSettings);
-
-    return promise.then(response => {
-      const { status } = response.xhr;
-
-      if (status !== 200) {
-        throw ServerConnection.makeError(response);
-      }
-
-    }).catch(reason => {
-      let message = 'Build failed, please run `jupyter quantlab build` on the server for full output';
-      if (reason.xhr.status === 400) {
-        message = 'Build aborted';
+    let source: EventSource | null = null;
+
+    // Listen to the events before the build starts to see its end.
+    return Private.connect(serverSettings).then(value => {
+      source = value;
+      const finished = Private.waitForBuild(source);
+      const promise = ServerConnection.makeRequest(request, serverSettings);
+
+      return promise.then(response => {
+        const { status } = response.xhr;
+
+        if (status !== 202) {
+          throw ServerConnection.makeError(response, BUILD_FAILED_MESSAGE);
+        }
+        return finished;
+
+      }, reason => {
+        throw ServerConnection.makeError(reason, BUILD_FAILED_MESSAGE);
+      });
+    }).then(() => {
+      source!.close();
+    }, reason => {
+      if (source) {
+        source.close();
       }
-      throw ServerConnection.makeError(reason, message);
+      throw reason;
     });
   }
 
@@ -169,3 +194,53 @@ namespace Builder {
   export
   interface IManager extends BuildManager { }
 }
+
+
+/**
+ * A namespace for private data.
+ */
+namespace Private {
+  /**
+   * Connect to the build events.
+   */
+  export
+  function connect(settings: ServerConnection.ISettings): Promise<EventSource> {
+    let url = URLExt.join(settings.baseUrl, BUILD_EVENTS_URL);
+    if (settings.token) {
+      url = url + `?token=${settings.token}`;
+    }
+    const source = new EventSource(url);
+
+    return new Promise<EventSource>((resolve, reject) => {
+      source.onopen = () => {
+        resolve(source);
+      };
+      source.onerror = () => {
+        source.close();
+        reject(new Error('Could not connect to the build events'));
+      };
+    });
+  }
+
+  /**
+   * Wait for the final status event of a build.
+   */
+  export
+  function waitForBuild(source: EventSource): Promise<void> {
+    return new Promise<void>((resolve, reject) => {
+      source.onerror = () => {
+        reject(new Error('Lost the connection to the build events'));
+      };
+      source.addEventListener('status', (event: Event) => {
+        const data = JSON.parse((event as MessageEvent).data);
+        if (data.status === 'stable') {
+          resolve(undefined);
+        } else if (data.status === 'canceled') {
+          reject(new Error('Build aborted'));
+        } else if (data.status === 'failed') {
+          reject(new Error(BUILD_FAILED_MESSAGE));
+        }
+      });
+    });
+  }
+}
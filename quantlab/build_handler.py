@@ -2,20 +2,41 @@
 
 # Copyright (c) Jupyter Development Team.
 # Distributed under the terms of the Modified BSD License.
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 import json
+import re
 from threading import Event
 
 from notebook.base.handlers import APIHandler
 from tornado import gen, web
 from tornado.concurrent import run_on_executor
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.queues import Queue
 
-from .commands import build, clean, build_check
+from .commands import (
+    build, clean, build_check, get_build_check_key, _LoggerProxy
+)
+from .process import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, Scheduler
+
+
+# The webpack progress lines of a streamed build.
+PROGRESS_REGEX = re.compile(r'^\[progress\] (\d+)% ?(.*)$')
+
+# The interval in seconds between keep-alive comments of an event stream.
+KEEPALIVE_INTERVAL = 30
+
+# The maximum number of events of a build kept for replay.
+MAX_BUILD_EVENTS = 10000
 
 
 class Builder(object):
     building = False
     executor = ThreadPoolExecutor(max_workers=5)
+    # Build checks do not wait behind the builds for a thread.
+    check_executor = ThreadPoolExecutor(max_workers=2)
     canceled = False
     _canceling = False
     _kill_event = None
@@ -25,14 +46,49 @@ class Builder(object):
         self.log = log
         self.core_mode = core_mode
         self.app_dir = app_dir
+        self._events = deque(maxlen=MAX_BUILD_EVENTS)
+        self._listeners = []
+        self._status_key = None
+        self._status_future = None
+        self._key_future = None
 
     @gen.coroutine
     def get_status(self):
         if self.core_mode:
             raise gen.Return(dict(status='stable', message=''))
         if self.building:
-            raise gen.Return(dict(status='building', message=''))
+            position = Scheduler.instance().get_position(self.app_dir)
+            message = ''
+            if position:
+                message = 'Waiting to run, position %s in the queue' % position
+            raise gen.Return(dict(status='building', message=message))
+
+        # Reuse the last status until an input of the build check changes,
+        # sharing the checks of concurrent requests.
+        future = self._key_future
+        if future is None:
+            future = self._run_build_check_key(self.app_dir)
+            self._key_future = future
+        try:
+            key = yield future
+        finally:
+            if self._key_future is future:
+                self._key_future = None
 
+        if key != self._status_key or self._status_future is None:
+            self._status_key = key
+            self._status_future = self._check_status()
+        future = self._status_future
+        try:
+            status = yield future
+        except Exception:
+            if self._status_future is future:
+                self._status_future = None
+            raise
+        raise gen.Return(dict(status))
+
+    @gen.coroutine
+    def _check_status(self):
         messages = yield self._run_build_check(self.app_dir, self.log)
 
         status = 'needed' if messages else 'stable'
@@ -53,16 +109,25 @@ class Builder(object):
             self._future = future = gen.Future()
             self.building = True
             self._kill_event = evt = Event()
+            self._events = deque(maxlen=MAX_BUILD_EVENTS)
+            loop = IOLoop.current()
+            emit = self._get_emitter()
+            emit(dict(type='status', status='building', message=''))
+            logger = _EventLogger(self.log, emit)
+            final = dict(type='status', status='stable', message='')
             try:
-                yield self._run_build(self.app_dir, self.log, evt)
+                yield self._run_build(self.app_dir, logger, evt, emit, loop)
                 future.set_result(True)
             except Exception as e:
                 if str(e) == 'Aborted':
                     future.set_result(False)
                 else:
                     future.set_exception(e)
+                final['status'] = 'canceled' if evt.is_set() else 'failed'
+                final['message'] = str(e)
             finally:
-                self.building = False
+                # End the build after the events queued by the build.
+                loop.add_callback(self._finish, final)
         try:
             yield self._future
         except Exception as e:
@@ -77,13 +142,61 @@ class Builder(object):
         self._canceling = False
         self.canceled = True
 
-    @run_on_executor
+    def add_listener(self, callback):
+        """Call a function with each event of the builds.
+
+        The function is first called with the events so far of the current
+        build, if any.
+        """
+        if self.building:
+            for event in self._events:
+                callback(event)
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """Stop calling a function with the build events.
+        """
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _get_emitter(self):
+        """Get a function that publishes events from any thread.
+
+        The events are published in order on the current IOLoop.
+        """
+        loop = IOLoop.current()
+        return lambda event: loop.add_callback(self._publish, event)
+
+    def _publish(self, event):
+        """Record an event of the current build and send it to listeners.
+        """
+        self._events.append(event)
+        for callback in list(self._listeners):
+            callback(event)
+
+    def _finish(self, event):
+        """End the current build and publish its final status event.
+        """
+        self.building = False
+        self._status_future = None
+        self._publish(event)
+
+    @run_on_executor(executor='check_executor')
+    def _run_build_check_key(self, app_dir):
+        return get_build_check_key(app_dir)
+
+    @run_on_executor(executor='check_executor')
     def _run_build_check(self, app_dir, logger):
-        return build_check(app_dir=app_dir, logger=logger)
+        return build_check(app_dir=app_dir, logger=logger,
+                           priority=PRIORITY_INTERACTIVE)
 
     @run_on_executor
-    def _run_build(self, app_dir, logger, kill_event):
-        kwargs = dict(app_dir=app_dir, logger=logger, kill_event=kill_event)
+    def _run_build(self, app_dir, logger, kill_event, emit, loop):
+        # The build commands run on the IOLoop, not in threads of their own.
+        on_phase = lambda phase: emit(dict(type='phase', phase=phase))
+        kwargs = dict(app_dir=app_dir, logger=logger, kill_event=kill_event,
+                      priority=PRIORITY_BACKGROUND, on_phase=on_phase,
+                      loop=loop)
         try:
             return build(**kwargs)
         except Exception as e:
@@ -103,6 +216,8 @@ class BuildHandler(APIHandler):
     @gen.coroutine
     def get(self):
         data = yield self.builder.get_status()
+        # Clients revalidate with the ETag of the status.
+        self.set_header('Cache-Control', 'no-cache')
         self.finish(json.dumps(data))
 
     @web.authenticated
@@ -116,20 +231,108 @@ class BuildHandler(APIHandler):
         self.set_status(204)
 
     @web.authenticated
-    @gen.coroutine
     def post(self):
+        # Clients follow the build with the build events.
         self.log.debug('Starting build')
+        future = self.builder.build()
+        if future.done():
+            try:
+                future.result()
+            except Exception as e:
+                raise web.HTTPError(500, str(e))
+        else:
+            IOLoop.current().add_future(future, self._build_done)
+        self.set_status(202)
+
+    def _build_done(self, future):
         try:
-            yield self.builder.build()
+            future.result()
         except Exception as e:
-            raise web.HTTPError(500, str(e))
+            self.log.warn('Build failed: %s', e)
+        else:
+            self.log.debug('Build finished')
+
+
+class BuildEventsHandler(APIHandler):
+    """A handler that streams the build events as server-sent events.
+
+    The events of the current build are replayed to new clients, and the
+    stream ends after the final status event of a build.  Each event is a
+    JSON object with a `type` of 'status', 'phase', 'progress' or 'log'.
+    """
+
+    # A stream that stays open is not user activity.
+    _track_activity = False
+
+    def initialize(self, builder):
+        self.builder = builder
+        self._queue = Queue()
+
+    @web.authenticated
+    @gen.coroutine
+    def get(self):
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        self.builder.add_listener(self._queue.put_nowait)
+        interval = timedelta(seconds=KEEPALIVE_INTERVAL)
+        try:
+            self.write(': connected\n\n')
+            yield self.flush()
+            while True:
+                try:
+                    event = yield self._queue.get(timeout=interval)
+                except gen.TimeoutError:
+                    self.write(': keep-alive\n\n')
+                    yield self.flush()
+                    continue
+                if event is None:
+                    break
+                self.write('event: %s\ndata: %s\n\n' % (
+                    event['type'], json.dumps(event)))
+                yield self.flush()
+                if _is_final(event):
+                    break
+        except StreamClosedError:
+            pass
+        finally:
+            self.builder.remove_listener(self._queue.put_nowait)
+
+    def on_connection_close(self):
+        self._queue.put_nowait(None)
+
 
-        if self.builder.canceled:
-            raise web.HTTPError(400, 'Build canceled')
+def _is_final(event):
+    """Test whether an event is the final status event of a build.
+    """
+    return event['type'] == 'status' and event['status'] != 'building'
 
-        self.log.debug('Build succeeded')
-        self.set_status(200)
+
+class _EventLogger(_LoggerProxy):
+    """A logger that also publishes its messages as build events.
+
+    The webpack progress lines are published as progress events and only
+    logged at the debug level.
+    """
+
+    def __init__(self, logger, emit):
+        self.logger = logger
+        self.emit = emit
+
+    def _log(self, method, msg, args, kwargs):
+        message = '%s' % (msg % args if args else msg,)
+        match = PROGRESS_REGEX.match(message)
+        if match:
+            self.logger.debug(msg, *args, **kwargs)
+            self.emit(dict(type='progress', percent=int(match.group(1)),
+                           message=match.group(2)))
+            return
+        getattr(self.logger, method)(msg, *args, **kwargs)
+        if method != 'debug':
+            self.emit(dict(type='log', level=method, message=message))
 
 
 # The path for quantlab build.
 build_path = r"/quantlab/api/build"
+
+# The path for the quantlab build events.
+build_events_path = r"/quantlab/api/build/events"
@@ -5,12 +5,16 @@
 # Distributed under the terms of the Modified BSD License.
 from __future__ import print_function
 
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
 from distutils.version import LooseVersion
 import errno
+import filecmp
 import glob
 import hashlib
 import json
 import logging
+import multiprocessing
 import os
 import os.path as osp
 import re
@@ -18,16 +22,28 @@ import shutil
 import site
 import sys
 import tarfile
+from contextlib import contextmanager
 from threading import Event
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 from ipython_genutils.tempdir import TemporaryDirectory
 from ipython_genutils.py3compat import which
 from jupyter_core.paths import jupyter_config_path
 from notebook.nbextensions import GREEN_ENABLED, GREEN_OK, RED_DISABLED, RED_X
+from tornado import gen
+from tornado.concurrent import chain_future
 
-from .semver import Range, gte, lt, lte, gt
+from .semver import intersects, make_range
 from .qlpmapp import YARN_PATH, HERE
-from .process import Process, WatchHelper
+from .packer import pack_directory
+from .resolver import DEPENDENCY_FIELDS, check_lockfile
+from .process import (
+    AsyncProcess, NodeWorker, Process, WatchHelper, PRIORITY_NORMAL
+)
 
 
 # The regex for expecting the webpack output.
@@ -36,6 +52,15 @@ WEBPACK_EXPECT = re.compile(r'.*/index.out.js')
 # The dev mode directory.
 DEV_DIR = osp.realpath(os.path.join(HERE, '..', 'dev_mode'))
 
+# The app directories written by a build.
+BUILD_OUTPUTS = ['static', 'schemas', 'themes']
+
+# The version of the compatibility check, part of the cached results key.
+COMPAT_VERSION = 2
+
+# The default size in megabytes of the build cache.
+DEFAULT_BUILD_CACHE_SIZE = 1024
+
 
 def pjoin(*args):
     """Join paths to create a real path.
@@ -86,13 +111,10 @@ def ensure_dev(logger=None):
     parent = pjoin(HERE, '..')
 
     if not osp.exists(pjoin(parent, 'node_modules')):
-        yarn_proc = Process(['node', YARN_PATH], cwd=parent, logger=logger)
-        yarn_proc.wait()
+        _run_command(['node', YARN_PATH], cwd=parent, logger=logger)
 
     if not osp.exists(pjoin(parent, 'dev_mode', 'build')):
-        yarn_proc = Process(['node', YARN_PATH, 'build'], cwd=parent,
-                            logger=logger)
-        yarn_proc.wait()
+        _run_command(['node', YARN_PATH, 'build'], cwd=parent, logger=logger)
 
 
 def watch_dev(logger=None):
@@ -108,8 +130,7 @@ def watch_dev(logger=None):
     parent = pjoin(HERE, '..')
 
     if not osp.exists(pjoin(parent, 'node_modules')):
-        yarn_proc = Process(['node', YARN_PATH], cwd=parent, logger=logger)
-        yarn_proc.wait()
+        _run_command(['node', YARN_PATH], cwd=parent, logger=logger)
 
     logger = logger or logging.getLogger('quantlab')
     ts_dir = osp.realpath(osp.join(HERE, '..', 'packages', 'metapackage'))
@@ -156,11 +177,27 @@ def install_extension(extension, app_dir=None, logger=None):
     handler.install_extension(extension)
 
 
+def install_extensions(extensions, app_dir=None, logger=None):
+    """Install extension packages into QuantLab in one transaction.
+    All of the extensions are validated before any is installed.
+    """
+    handler = _AppHandler(app_dir, logger)
+    handler.install_extensions(extensions)
+
+
 def uninstall_extension(name, app_dir=None, logger=None):
     """Uninstall an extension by name or path.
     """
     handler = _AppHandler(app_dir, logger)
-    handler.uninstall_extension(name)
+    return handler.uninstall_extension(name)
+
+
+def uninstall_extensions(names, app_dir=None, logger=None):
+    """Uninstall extensions by name in one transaction.
+    Returns whether any extension was uninstalled.
+    """
+    handler = _AppHandler(app_dir, logger)
+    return handler.uninstall_extensions(names)
 
 
 def clean(app_dir=None):
@@ -178,19 +215,34 @@ def clean(app_dir=None):
 
 def build(app_dir=None, name=None, version=None, logger=None,
         command='build:prod', kill_event=None,
-        clean_staging=False):
+        clean_staging=False, force_install=False,
+        priority=PRIORITY_NORMAL, stream=False, on_phase=None, loop=None):
     """Build the QuantLab application.
+
+    If `stream` is set, the output of the build commands and the webpack
+    progress are sent to the logger line by line.  The `on_phase` callback
+    is called with the name of each phase of the build: 'staging',
+    'install' and 'webpack'.
+
+    If an IOLoop is given as `loop`, the build commands run on it as
+    `AsyncProcess` objects instead of with threads of their own, and their
+    output is streamed.  The build must then run on another thread.
+
+    Returns the stats records of the processes run by the build.
     """
-    handler = _AppHandler(app_dir, logger, kill_event=kill_event)
+    handler = _AppHandler(app_dir, logger, kill_event=kill_event,
+                          priority=priority, stream=stream, loop=loop)
     handler.build(name=name, version=version,
-                  command=command, clean_staging=clean_staging)
+                  command=command, clean_staging=clean_staging,
+                  force_install=force_install, on_phase=on_phase)
+    return handler.process_stats
 
 
 def get_app_info(app_dir=None, logger=None):
     """Get a dictionary of information about the app.
     """
     handler = _AppHandler(app_dir, logger)
-    return handler.info
+    return handler.info.load()
 
 
 def enable_extension(extension, app_dir=None, logger=None):
@@ -207,14 +259,47 @@ def disable_extension(extension, app_dir=None, logger=None):
     handler.toggle_extension(extension, True)
 
 
-def build_check(app_dir=None, logger=None):
+def build_check(app_dir=None, logger=None, priority=PRIORITY_NORMAL):
     """Determine whether QuantLab should be built.
     Returns a list of messages.
     """
-    handler = _AppHandler(app_dir, logger)
+    handler = _AppHandler(app_dir, logger, priority=priority)
     return handler.build_check()
 
 
+def get_build_check_key(app_dir=None):
+    """Get a key of the inputs of `build_check` from their stat info.
+
+    The key changes whenever the result of `build_check` may change, and
+    is much cheaper to compute.
+    """
+    app_dir = app_dir or get_app_dir()
+    paths = [
+        pjoin(HERE, 'staging', 'package.json'),
+        pjoin(app_dir, 'settings', 'build_config.json'),
+        pjoin(app_dir, 'settings', 'page_config.json'),
+        pjoin(app_dir, 'staging', 'package.json'),
+        pjoin(app_dir, 'static', 'package.json')
+    ]
+    for dname in sorted(set([get_app_dir(), app_dir])):
+        ext_dir = pjoin(dname, 'extensions')
+        paths.append(ext_dir)
+        paths.extend(sorted(glob.glob(pjoin(ext_dir, '*.tgz'))))
+
+    items = []
+    for path in paths:
+        items.append([path, _stat_key(path) if osp.exists(path) else None])
+
+    # Local extensions and linked packages are built from their sources.
+    config = _ConfigStore(pjoin(app_dir, 'settings', 'build_config.json'))
+    for source in ['local_extensions', 'linked_packages']:
+        for path in sorted(config.read().get(source, dict()).values()):
+            fingerprint = _fingerprint(path) if osp.exists(path) else None
+            items.append([path, fingerprint])
+
+    return hashlib.sha1(json.dumps(items).encode('utf-8')).hexdigest()
+
+
 def list_extensions(app_dir=None, logger=None):
     """List the extensions.
     """
@@ -247,72 +332,116 @@ def get_app_version():
 
 class _AppHandler(object):
 
-    def __init__(self, app_dir, logger=None, kill_event=None):
+    def __init__(self, app_dir, logger=None, kill_event=None,
+                 priority=PRIORITY_NORMAL, stream=False, loop=None):
         if app_dir and app_dir.startswith(HERE):
             raise ValueError('Cannot run lab extension commands in core app')
         self.app_dir = app_dir or get_app_dir()
         self.sys_dir = get_app_dir()
         self.logger = logger or logging.getLogger('quantlab')
+        self._indexes = dict()
+        self._dirty_indexes = set()
+        settings = pjoin(self.app_dir, 'settings')
+        self._build_config = _ConfigStore(pjoin(settings, 'build_config.json'))
+        self._page_config = _ConfigStore(pjoin(settings, 'page_config.json'))
         self.info = self._get_app_info()
         self.kill_event = kill_event or Event()
+        self.priority = priority
+        self.stream = stream or loop is not None
+        self.loop = loop
+        self.process_stats = []
 
     def install_extension(self, extension, existing=None):
         """Install an extension package into QuantLab.
         The extension is first validated.
         """
-        extension = _normalize_path(extension)
-        extensions = self.info['extensions']
+        self.install_extensions([extension])
 
-        # Check for a core extensions.
-        if extension in self.info['core_extensions']:
+    def install_extensions(self, extensions):
+        """Install extension packages into QuantLab in one transaction.
+        All of the extensions are validated before any is installed.
+        """
+        extensions = [_normalize_path(e) for e in extensions]
+        existing = self.info['extensions']
+        core = self.info['core_extensions']
+
+        # Install the packages using a temporary directory.
+        infos = []
+        packages = [e for e in extensions if e not in core]
+        if packages:
+            self._ensure_app_dirs()
+            with TemporaryDirectory() as tempdir:
+                infos = self._install_extensions(packages, tempdir)
+
+        with self._build_config.transaction():
             config = self._read_build_config()
-            uninstalled = config.get('uninstalled_core_extensions', [])
-            if extension in uninstalled:
-                uninstalled.remove(extension)
-                config['uninstalled_core_extensions'] = uninstalled
-                self._write_build_config(config)
-            return
-
-        # Create the app dirs if needed.
-        self._ensure_app_dirs()
+            config_changed = False
 
-        # Install the package using a temporary directory.
-        with TemporaryDirectory() as tempdir:
-            info = self._install_extension(extension, tempdir)
-
-        name = info['name']
+            # Reinstall uninstalled core extensions.
+            uninstalled = config.get('uninstalled_core_extensions', [])
+            for extension in [e for e in extensions if e in core]:
+                if extension in uninstalled:
+                    uninstalled.remove(extension)
+                    config['uninstalled_core_extensions'] = uninstalled
+                    config_changed = True
 
-        # Local directories get name mangled and stored in metadata.
-        if info['is_dir']:
-            config = self._read_build_config()
+            # Local directories get name mangled and stored in metadata.
             local = config.setdefault('local_extensions', dict())
-            local[name] = info['source']
-            self._write_build_config(config)
+            for info in infos:
+                name = info['name']
+                if info['is_dir'] and local.get(name) != info['source']:
+                    local[name] = info['source']
+                    config_changed = True
+
+            if config_changed:
+                self._write_build_config(config)
 
         # Remove an existing extension with the same name and different path
-        if name in extensions:
-            other = extensions[name]
-            if other['path'] != info['path'] and other['location'] == 'app':
-                os.remove(other['path'])
+        for info in infos:
+            name = info['name']
+            if name in existing:
+                other = existing[name]
+                if (other['path'] != info['path'] and
+                        other['location'] == 'app' and
+                        osp.exists(other['path'])):
+                    os.remove(other['path'])
 
     def build(self, name=None, version=None, command='build:prod',
-            clean_staging=False):
+            clean_staging=False, force_install=False, on_phase=None):
         """Build the application.
         """
+        on_phase = on_phase or (lambda phase: None)
+
         # Set up the build directory.
         app_dir = self.app_dir
 
+        on_phase('staging')
         self._populate_staging(
             name=name, version=version, clean=clean_staging
         )
 
         staging = pjoin(app_dir, 'staging')
 
+        # Use a cached build of the same inputs if available.
+        shas = self._get_file_shas(staging)
+        manifest = _get_build_manifest(staging, command, shas)
+        if not force_install and self._restore_build(manifest):
+            return
+
         # Make sure packages are installed.
-        self._run(['node', YARN_PATH, 'install'], cwd=staging)
+        on_phase('install')
+        self._install_packages(staging, force=force_install)
 
         # Build the app.
-        self._run(['node', YARN_PATH, 'run', command], cwd=staging)
+        on_phase('webpack')
+        env = None
+        if self.stream:
+            # Have webpack report its progress on separate lines.
+            env = dict(os.environ, QUANTLAB_BUILD_PROGRESS='1')
+        ret = self._run(['node', YARN_PATH, 'run', command], cwd=staging,
+                        env=env)
+        if ret == 0:
+            self._store_build(manifest)
 
     def watch(self):
         """Start the application watcher and then run the watch in
@@ -323,7 +452,7 @@ class _AppHandler(object):
         self._populate_staging()
 
         # Make sure packages are installed.
-        self._run(['node', YARN_PATH, 'install'], cwd=staging)
+        self._install_packages(staging)
 
         proc = WatchHelper(['node', YARN_PATH, 'run', 'watch'],
             cwd=pjoin(self.app_dir, 'staging'),
@@ -429,57 +558,71 @@ class _AppHandler(object):
                 msg = '%s changed from %s to %s'
                 messages.append(msg % (pkg, old_deps[pkg], new_deps[pkg]))
 
-        # Look for updated local extensions.
+        if fast:
+            return messages
+
+        # Look for updated local extensions and linked packages.
+        items = []
         for (name, source) in local.items():
-            if fast:
-                continue
             dname = pjoin(app_dir, 'extensions')
-            if self._check_local(name, source, dname):
-                messages.append('%s content changed' % name)
+            items.append((name, source, dname))
 
-        # Look for updated linked packages.
         for (name, item) in linked.items():
-            if fast:
-                continue
             dname = pjoin(app_dir, 'staging', 'linked_packages')
-            if self._check_local(name, item['source'], dname):
-                messages.append('%s content changed' % name)
+            items.append((name, item['source'], dname))
+
+        for name in self._check_locals(items):
+            messages.append('%s content changed' % name)
 
         return messages
 
     def uninstall_extension(self, name):
         """Uninstall an extension by name.
         """
-        # Allow for uninstalled core extensions.
-        data = self.info['core_data']
-        if name in self.info['core_extensions']:
-            self.logger.info('Uninstalling core extension %s' % name)
+        return self.uninstall_extensions([name])
+
+    def uninstall_extensions(self, names):
+        """Uninstall extensions by name in one transaction.
+        Returns whether any extension was uninstalled.
+        """
+        with self._build_config.transaction():
             config = self._read_build_config()
+            local = config.setdefault('local_extensions', dict())
             uninstalled = config.get('uninstalled_core_extensions', [])
-            if name not in uninstalled:
-                uninstalled.append(name)
-                config['uninstalled_core_extensions'] = uninstalled
-                self._write_build_config(config)
-            return True
+            config_changed = False
+            found = False
+
+            for name in names:
+                # Allow for uninstalled core extensions.
+                if name in self.info['core_extensions']:
+                    self.logger.info('Uninstalling core extension %s' % name)
+                    if name not in uninstalled:
+                        uninstalled.append(name)
+                        config['uninstalled_core_extensions'] = uninstalled
+                        config_changed = True
+                    found = True
+                    continue
 
-        local = self.info['local_extensions']
+                data = self.info['extensions'].get(name)
+                if not data or not osp.exists(data['path']):
+                    msg = 'No labextension named "%s" installed'
+                    self.logger.warn(msg % name)
+                    continue
 
-        for (extname, data) in self.info['extensions'].items():
-            path = data['path']
-            if extname == name:
+                path = data['path']
                 msg = 'Uninstalling %s from %s' % (name, osp.dirname(path))
                 self.logger.info(msg)
                 os.remove(path)
+                found = True
+
                 # Handle local extensions.
-                if extname in local:
-                    config = self._read_build_config()
-                    data = config.setdefault('local_extensions', dict())
-                    del data[extname]
-                    self._write_build_config(config)
-                return True
+                if name in local:
+                    del local[name]
+                    config_changed = True
 
-        self.logger.warn('No labextension named "%s" installed' % name)
-        return False
+            if config_changed:
+                self._write_build_config(config)
+            return found
 
     def link_package(self, path):
         """Link a package at the given path.
@@ -492,7 +635,7 @@ class _AppHandler(object):
         with TemporaryDirectory() as tempdir:
             info = self._extract_package(path, tempdir)
 
-        messages = _validate_extension(info['data'])
+        messages = info['messages']
         if not messages:
             return self.install_extension(path)
 
@@ -501,88 +644,98 @@ class _AppHandler(object):
         [self.logger.warn(m) for m in messages]
 
         # Add to metadata.
-        config = self._read_build_config()
-        linked = config.setdefault('linked_packages', dict())
-        linked[info['name']] = info['source']
-        self._write_build_config(config)
+        with self._build_config.transaction():
+            config = self._read_build_config()
+            linked = config.setdefault('linked_packages', dict())
+            linked[info['name']] = info['source']
+            self._write_build_config(config)
 
     def unlink_package(self, path):
         """Link a package by name or at the given path.
         """
         path = _normalize_path(path)
-        config = self._read_build_config()
-        linked = config.setdefault('linked_packages', dict())
-
-        found = None
-        for (name, source) in linked.items():
-            if name == path or source == path:
-                found = name
+        with self._build_config.transaction():
+            config = self._read_build_config()
+            linked = config.setdefault('linked_packages', dict())
 
-        if found:
-            del linked[found]
-        else:
-            local = config.setdefault('local_extensions', dict())
-            for (name, source) in local.items():
+            found = None
+            for (name, source) in linked.items():
                 if name == path or source == path:
                     found = name
-            if found:
-                del local[found]
-                path = self.info['extensions'][found]['path']
-                os.remove(path)
 
-        if not found:
-            raise ValueError('No linked package for %s' % path)
+            if found:
+                del linked[found]
+            else:
+                local = config.setdefault('local_extensions', dict())
+                for (name, source) in local.items():
+                    if name == path or source == path:
+                        found = name
+                if found:
+                    del local[found]
+                    path = self.info['extensions'][found]['path']
+                    os.remove(path)
+
+            if not found:
+                raise ValueError('No linked package for %s' % path)
 
-        self._write_build_config(config)
+            self._write_build_config(config)
 
     def toggle_extension(self, extension, value):
         """Enable or disable a lab extension.
         """
-        config = self._read_page_config()
-        disabled = config.setdefault('disabledExtensions', [])
-        if value and extension not in disabled:
-            disabled.append(extension)
-        if not value and extension in disabled:
-            disabled.remove(extension)
-        self._write_page_config(config)
+        with self._page_config.transaction():
+            config = self._read_page_config()
+            disabled = config.setdefault('disabledExtensions', [])
+            if value and extension not in disabled:
+                disabled.append(extension)
+            if not value and extension in disabled:
+                disabled.remove(extension)
+            self._write_page_config(config)
 
     def _get_app_info(self):
         """Get information about the app.
-        """
 
-        info = dict()
-        info['core_data'] = core_data = _get_core_data()
-        info['extensions'] = extensions = self._get_extensions(core_data)
-        page_config = self._read_page_config()
-        info['disabled'] = page_config.get('disabledExtensions', [])
-        info['local_extensions'] = self._get_local_extensions()
-        info['linked_packages'] = self._get_linked_packages()
-        info['app_extensions'] = app = []
-        info['sys_extensions'] = sys = []
-        for (name, data) in extensions.items():
-            data['is_local'] = name in info['local_extensions']
-            if data['location'] == 'app':
-                app.append(name)
-            else:
-                sys.append(name)
-
-        info['uninstalled_core'] = self._get_uninstalled_core_extensions()
-        info['version'] = core_data['quantlab']['version']
-        info['sys_dir'] = self.sys_dir
-        info['app_dir'] = self.app_dir
-
-        info['core_extensions'] = core_extensions = _get_core_extensions()
-
-        disabled_core = []
-        for key in core_extensions:
-            if key in info['disabled']:
-                disabled_core.append(key)
+        The fields are computed and memoized on first access.
+        """
+        info = _AppInfo()
+        info.add_loader('core_data', _get_core_data)
+        info.add_loader('version',
+            lambda: info['core_data']['quantlab']['version'])
+        info.add_loader('sys_dir', lambda: self.sys_dir)
+        info.add_loader('app_dir', lambda: self.app_dir)
+
+        def get_extensions():
+            extensions = self._get_extensions(info['core_data'])
+            for (name, data) in extensions.items():
+                data['is_local'] = name in info['local_extensions']
+            return extensions
 
-        info['disabled_core'] = disabled_core
+        def get_location(location):
+            extensions = info['extensions']
+            return [name for (name, data) in extensions.items()
+                    if data['location'] == location]
+
+        info.add_loader('extensions', get_extensions)
+        info.add_loader('app_extensions', lambda: get_location('app'))
+        info.add_loader('sys_extensions', lambda: get_location('sys'))
+
+        info.add_loader('disabled',
+            lambda: self._read_page_config().get('disabledExtensions', []))
+        info.add_loader('local_extensions', self._get_local_extensions)
+        info.add_loader('linked_packages', self._get_linked_packages)
+        info.add_loader('uninstalled_core',
+            self._get_uninstalled_core_extensions)
+        info.add_loader('core_extensions', _get_core_extensions)
+        info.add_loader('disabled_core', lambda: [
+            key for key in info['core_extensions'] if key in info['disabled']
+        ])
         return info
 
     def _populate_staging(self, name=None, version=None, clean=False):
         """Set up the assets in the staging directory.
+
+        Only the files whose content differs are written, so unchanged
+        files keep their mtimes for the tools that watch them.
         """
         app_dir = self.app_dir
         staging = pjoin(app_dir, 'staging')
@@ -611,28 +764,41 @@ class _AppHandler(object):
                 'yarn.lock', '.yarnrc', 'yarn.js']:
             if fname == 'yarn.lock' and not overwrite_lock:
                 continue
-            shutil.copy(pjoin(HERE, 'staging', fname), pjoin(staging, fname))
+            target = pjoin(staging, fname)
+            source = pjoin(HERE, 'staging', fname)
+            if osp.exists(target) and filecmp.cmp(source, target, False):
+                continue
+            shutil.copy(source, target)
 
-        # Ensure a clean linked packages directory.
+        # Ensure a linked packages directory.
         linked_dir = pjoin(staging, 'linked_packages')
-        if osp.exists(linked_dir):
-            shutil.rmtree(linked_dir)
-        os.makedirs(linked_dir)
+        if not osp.exists(linked_dir):
+            os.makedirs(linked_dir)
 
         # Template the package.json file.
-        # Update the local extensions.
+        # Update the local extensions and the linked packages.
+        items = []
         extensions = self.info['extensions']
         for (key, source) in self.info['local_extensions'].items():
             dname = pjoin(app_dir, 'extensions')
-            self._update_local(key, source, dname, extensions[key],
-                'local_extensions')
+            items.append((source, dname, extensions[key]))
 
-        # Update the linked packages.
         linked = self.info['linked_packages']
         for (key, item) in linked.items():
             dname = pjoin(staging, 'linked_packages')
-            self._update_local(key, item['source'], dname, item,
-                'linked_packages')
+            items.append((item['source'], dname, item))
+
+        self._update_locals(items)
+
+        # Remove stale files from the linked packages directory.
+        keep = [item['filename'] for item in linked.values()]
+        for fname in os.listdir(linked_dir):
+            if fname not in keep:
+                path = pjoin(linked_dir, fname)
+                if osp.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
 
         # Then get the package template.
         data = self._get_package_template()
@@ -643,15 +809,21 @@ class _AppHandler(object):
         if name:
             data['quantlab']['name'] = name
 
+        content = json.dumps(data, indent=4)
         pkg_path = pjoin(staging, 'package.json')
+        if osp.exists(pkg_path):
+            with open(pkg_path) as fid:
+                if fid.read() == content:
+                    return
+
         with open(pkg_path, 'w') as fid:
-            json.dump(data, fid, indent=4)
+            fid.write(content)
 
     def _get_package_template(self, silent=False):
         """Get the template the for staging package.json file.
         """
         logger = self.logger
-        data = self.info['core_data']
+        data = _thaw(self.info['core_data'])
         local = self.info['local_extensions']
         linked = self.info['linked_packages']
         extensions = self.info['extensions']
@@ -712,35 +884,225 @@ class _AppHandler(object):
 
         return data
 
-    def _check_local(self, name, source, dname):
-        # Extract the package in a temporary directory.
+    def _check_locals(self, items):
+        """Get the names of the local dependencies that have changed.
+
+        `items` is a list of (name, source, dname) tuples.
+        """
         with TemporaryDirectory() as tempdir:
-            info = self._extract_package(source, tempdir)
-            # Test if the file content has changed.
-            target = pjoin(dname, info['filename'])
-            return not osp.exists(target)
+            sources = [(source, dname) for (_, source, dname) in items]
+            results = self._pack_locals(sources, tempdir)
+
+        changed = []
+        for ((name, _, dname), info) in zip(items, results):
+            if not osp.exists(pjoin(dname, info['filename'])):
+                changed.append(name)
+        return changed
 
-    def _update_local(self, name, source, dname, data, dtype):
-        """Update a local dependency.  Return `True` if changed.
+    def _update_locals(self, items):
+        """Update local dependencies in place.
+
+        `items` is a list of (source, dname, data) tuples.
         """
-        # Extract the package in a temporary directory.
-        existing = data['filename']
         with TemporaryDirectory() as tempdir:
-            info = self._extract_package(source, tempdir)
+            sources = [(source, dname) for (source, dname, _) in items]
+            results = self._pack_locals(sources, tempdir)
+
+            for ((_, dname, data), info) in zip(items, results):
+                # Bail if the file content has not changed.
+                existing = data['filename']
+                target = pjoin(dname, info['filename'])
+                if 'path' not in info or osp.exists(target):
+                    continue
+
+                shutil.move(info['path'], target)
+                self._add_to_extension_index(target, info)
+
+                # Remove the existing tarball and update the file name.
+                if existing and osp.exists(pjoin(dname, existing)):
+                    os.remove(pjoin(dname, existing))
+                data['filename'] = info['filename']
+                data['path'] = pjoin(data['tar_dir'], data['filename'])
+
+        self._write_indexes()
+
+    def _pack_locals(self, sources, tempdir):
+        """Pack local sources concurrently into a temporary directory.
+
+        `sources` is a list of (source, dname) tuples.  Returns a list
+        with the package info of each source, or only its file name when
+        the source is unchanged and already packed in `dname`.  The log
+        output of each source is replayed in order.
+        """
+        def pack(index, source, dname, logger):
+            filename = self._get_fingerprinted(source)
+            if filename and osp.exists(pjoin(dname, filename)):
+                return dict(filename=filename)
+            path = pjoin(tempdir, str(index))
+            os.makedirs(path)
+            return self._extract_package(source, path, logger=logger)
+
+        items = [(i, s, d) for (i, (s, d)) in enumerate(sources)]
+        return self._run_workers(pack, items)
+
+    def _run_workers(self, func, items):
+        """Call a function on argument tuples concurrently.
+
+        The function is called with the arguments and a logger whose
+        output is replayed in order.  Returns the results in order.
+        """
+        if not items:
+            return []
+
+        # Load the indexes before the workers share them.
+        self._read_index('extension_index')
+        self._read_index('local_fingerprints')
+
+        results = []
+        workers = min(_get_pack_workers(), len(items))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            loggers = [_BufferedLogger() for _ in items]
+            pending = []
+            for (args, logger) in zip(items, loggers):
+                pending.append(executor.submit(func, *(args + (logger,))))
+            for (future, logger) in zip(pending, loggers):
+                try:
+                    results.append(future.result())
+                finally:
+                    logger.replay(self.logger)
+
+        return results
+
+    def _install_packages(self, path, force=False):
+        """Run yarn install unless the install stamp is up to date.
+        Returns the exit code.
+        """
+        stamp = pjoin(path, 'node_modules', '.quantlab-install-stamp')
+        shas = self._get_file_shas(path)
+        if not force and osp.exists(stamp):
+            with open(stamp) as fid:
+                if fid.read() == _get_install_stamp(path, shas):
+                    self.logger.debug('Skipping install in %s' % path)
+                    return 0
+
+        # Use the lock file as is when it satisfies every dependency.
+        args = ['node', YARN_PATH, 'install']
+        ret = None
+        if self._check_lockfile(path):
+            ret = self._run(args + ['--frozen-lockfile', '--prefer-offline'],
+                            cwd=path)
+            if ret != 0:
+                self.logger.debug('Frozen install failed in %s' % path)
+        if ret != 0:
+            ret = self._run(args, cwd=path)
+        if ret == 0 and osp.exists(osp.dirname(stamp)):
+            with open(stamp, 'w') as fid:
+                fid.write(_get_install_stamp(path, shas))
+        return ret
+
+    def _get_file_shas(self, path):
+        """Get the content shas of the tarballs of the `file:` dependencies
+        of a directory, by package name.
+
+        Tarballs are named by package name and version, so their contents
+        can change under the same name.
+        """
+        with open(pjoin(path, 'package.json')) as fid:
+            data = json.load(fid)
+
+        shas = dict()
+        for field in DEPENDENCY_FIELDS:
+            for (name, spec) in (data.get(field) or dict()).items():
+                if not spec.startswith('file:'):
+                    continue
+                target = pjoin(path, spec[len('file:'):])
+                if osp.isfile(target):
+                    shas[name] = self._inspect_package(target)['sha']
+        self._write_indexes()
+        return shas
+
+    def _check_lockfile(self, path):
+        """Check the dependencies of a directory against its lock file.
+
+        Warns about conflicting singleton packages and returns whether the
+        lock file satisfies every dependency.
+        """
+        core_data = self.info['core_data']
+        singletons = core_data['quantlab']['singletonPackages']
+        # Read the package data of the tarballs from the extension index.
+        def read_tarball(target):
+            return self._inspect_package(target)['data']
+
+        try:
+            result = check_lockfile(path, singletons, read_tarball)
+        except (IOError, OSError, ValueError) as e:
+            self.logger.debug('Could not check the lock file: %s' % e)
+            return False
+        finally:
+            self._write_indexes()
+
+        for (name, spec1, spec2) in result['conflicts']:
+            self.logger.warn(
+                'Conflicting ranges of singleton package "%s": "%s" and '
+                '"%s"' % (name, spec1, spec2)
+            )
+        if result['unresolved']:
+            self.logger.debug(
+                'Dependencies to resolve: %s' % ', '.join(result['unresolved'])
+            )
+        return result['satisfied']
 
-            # Bail if the file content has not changed.
-            if info['filename'] == existing:
-                return existing
+    def _restore_build(self, manifest):
+        """Restore the build outputs from the build cache.
 
-            shutil.move(info['path'], pjoin(dname, info['filename']))
+        Returns whether the manifest was found in the cache.
+        """
+        entry = pjoin(self.app_dir, 'build_cache', manifest)
+        if not osp.exists(entry):
+            return False
+
+        self.logger.info('Restoring build %s from cache', manifest[:12])
+        for dname in BUILD_OUTPUTS:
+            target = pjoin(self.app_dir, dname)
+            if osp.exists(target):
+                shutil.rmtree(target)
+            if osp.exists(pjoin(entry, dname)):
+                shutil.copytree(pjoin(entry, dname), target)
+
+        # Restore the lock file that was resolved for the build.
+        lock = pjoin(entry, 'yarn.lock')
+        if osp.exists(lock):
+            shutil.copy(lock, pjoin(self.app_dir, 'staging', 'yarn.lock'))
+
+        # Mark the entry as recently used.
+        os.utime(entry, None)
+        return True
+
+    def _store_build(self, manifest):
+        """Store the build outputs in the build cache.
+        """
+        max_size = _get_build_cache_size(self.logger)
+        cache_dir = pjoin(self.app_dir, 'build_cache')
+        entry = pjoin(cache_dir, manifest)
+        temp = '%s.%s.tmp' % (entry, os.getpid())
+        if not max_size or osp.exists(entry):
+            return
 
-        # Remove the existing tarball and return the new file name.
-        if existing:
-            os.remove(pjoin(dname, existing))
+        try:
+            for dname in BUILD_OUTPUTS:
+                source = pjoin(self.app_dir, dname)
+                if osp.exists(source):
+                    shutil.copytree(source, pjoin(temp, dname))
+            lock = pjoin(self.app_dir, 'staging', 'yarn.lock')
+            if osp.exists(lock):
+                shutil.copy(lock, pjoin(temp, 'yarn.lock'))
+            os.rename(temp, entry)
+        except (IOError, OSError) as e:
+            self.logger.debug('Could not cache build: %s' % e)
+            shutil.rmtree(temp, True)
+            return
 
-        data['filename'] = info['filename']
-        data['path'] = pjoin(data['tar_dir'], data['filename'])
-        return info['filename']
+        _evict_build_cache(cache_dir, max_size)
 
     def _get_extensions(self, core_data):
         """Get the extensions for the application.
@@ -757,9 +1119,11 @@ class _AppHandler(object):
         # Look in app_dir if different.
         app_path = pjoin(app_dir, 'extensions')
         if app_path == sys_path or not osp.exists(app_path):
+            self._write_indexes()
             return extensions
 
         extensions.update(self._get_extensions_in_dir(app_dir, core_data))
+        self._write_indexes()
 
         return extensions
 
@@ -769,7 +1133,7 @@ class _AppHandler(object):
         extensions = dict()
         location = 'app' if dname == self.app_dir else 'sys'
         for target in glob.glob(pjoin(dname, 'extensions', '*.tgz')):
-            data = _read_package(target)
+            data = self._inspect_package(target)['data']
             deps = data.get('dependencies', dict())
             name = data['name']
             jlab = data.get('quantlab', dict())
@@ -785,12 +1149,29 @@ class _AppHandler(object):
 
     def _get_extension_compat(self):
         """Get the extension compatibility info.
+
+        The result for each extension is cached in the extension index
+        for the current core version and singleton packages.
         """
         compat = dict()
         core_data = self.info['core_data']
+        core_key = _get_compat_key(core_data)
+        index = self._read_index('extension_index')
         for (name, data) in self.info['extensions'].items():
+            key = [name, data['version'], core_key]
+            entry = index.get(data['path'], dict())
+            if entry.get('compat_key') == key:
+                compat[name] = [tuple(e) for e in entry['compat']]
+                continue
+
             deps = data['dependencies']
             compat[name] = _validate_compatibility(name, deps, core_data)
+            if entry:
+                entry['compat_key'] = key
+                entry['compat'] = compat[name]
+                self._dirty_indexes.add('extension_index')
+
+        self._write_indexes()
         return compat
 
     def _get_local_extensions(self):
@@ -811,7 +1192,7 @@ class _AppHandler(object):
 
         for path in glob.glob(pjoin(dname, '*.tgz')):
             path = osp.realpath(path)
-            data = _read_package(path)
+            data = self._inspect_package(path)['data']
             name = data['name']
             if name not in info:
                 self.logger.warn('Removing orphaned linked package %s' % name)
@@ -822,6 +1203,7 @@ class _AppHandler(object):
             item['path'] = path
             item['version'] = data['version']
             item['data'] = data
+        self._write_indexes()
         return info
 
     def _get_uninstalled_core_extensions(self):
@@ -879,113 +1261,219 @@ class _AppHandler(object):
     def _read_build_config(self):
         """Get the build config data for the app dir.
         """
-        target = pjoin(self.app_dir, 'settings', 'build_config.json')
-        if not osp.exists(target):
-            return {}
-        else:
-            with open(target) as fid:
-                return json.load(fid)
+        return self._build_config.read()
 
     def _write_build_config(self, config):
         """Write the build config to the app dir.
         """
         self._ensure_app_dirs()
-        target = pjoin(self.app_dir, 'settings', 'build_config.json')
-        with open(target, 'w') as fid:
-            json.dump(config, fid, indent=4)
+        self._build_config.write(config)
 
     def _read_page_config(self):
         """Get the page config data for the app dir.
         """
-        target = pjoin(self.app_dir, 'settings', 'page_config.json')
-        if not osp.exists(target):
-            return {}
-        else:
-            with open(target) as fid:
-                return json.load(fid)
+        return self._page_config.read()
 
     def _write_page_config(self, config):
-        """Write the build config to the app dir.
+        """Write the page config to the app dir.
         """
         self._ensure_app_dirs()
-        target = pjoin(self.app_dir, 'settings', 'page_config.json')
-        with open(target, 'w') as fid:
-            json.dump(config, fid, indent=4)
+        self._page_config.write(config)
 
-    def _get_local_data(self, source):
-        """Get the local data for extensions or linked packages.
+    def _inspect_package(self, target):
+        """Inspect a package tarball using the extension index.
+
+        The index is keyed by the tarball path and only tarballs whose
+        size, mtime, or inode changed since the last read are opened.
         """
-        config = self._read_build_config()
+        index = self._read_index('extension_index')
+        path = osp.realpath(target)
+        entry = index.get(path)
+        if entry and 'sha' in entry and entry['stat'] == _stat_key(path):
+            return entry
 
-        data = config.setdefault(source, dict())
-        dead = []
-        for (name, source) in data.items():
-            if not osp.exists(source):
-                dead.append(name)
+        return self._add_to_extension_index(path, _inspect_package(path))
 
-        for name in dead:
-            link_type = source.replace('_', ' ')
-            msg = '**Note: Removing dead %s "%s"' % (link_type, name)
-            self.logger.warn(msg)
-            del data[name]
+    def _add_to_extension_index(self, target, inspection):
+        """Add the inspection of a package tarball to the extension index.
+        """
+        index = self._read_index('extension_index')
+        path = osp.realpath(target)
+        entry = dict(stat=_stat_key(path))
+        for key in ['data', 'sha', 'messages']:
+            entry[key] = inspection[key]
+        index[path] = entry
+        self._dirty_indexes.add('extension_index')
+        return entry
+
+    def _get_fingerprinted(self, source):
+        """Get the packed file name of an unchanged local source.
+        """
+        index = self._read_index('local_fingerprints')
+        entry = index.get(osp.realpath(source))
+        if entry and entry['fingerprint'] == _fingerprint(source):
+            return entry['filename']
 
-        if dead:
-            self._write_build_config(config)
+    def _set_fingerprinted(self, source, fingerprint, filename):
+        """Record the packed file name of a local source.
+        """
+        index = self._read_index('local_fingerprints')
+        entry = dict(fingerprint=fingerprint, filename=filename)
+        index[osp.realpath(source)] = entry
+        self._dirty_indexes.add('local_fingerprints')
 
-        return data
+    def _read_index(self, name):
+        """Get a path-keyed index stored in the app settings directory.
+        """
+        if name in self._indexes:
+            return self._indexes[name]
 
-    def _install_extension(self, extension, tempdir):
-        """Install an extension with validation and return the name and path.
+        target = pjoin(self.app_dir, 'settings', name + '.json')
+        index = dict()
+        if osp.exists(target):
+            try:
+                with open(target) as fid:
+                    index = json.load(fid)
+            except ValueError:
+                self.logger.debug('Ignoring invalid index %s' % name)
+        self._indexes[name] = index
+        return index
+
+    def _write_indexes(self):
+        """Write the indexes that have changed.
         """
-        info = self._extract_package(extension, tempdir)
-        data = info['data']
+        dirty = sorted(self._dirty_indexes)
+        self._dirty_indexes.clear()
 
-        # Verify that the package is an extension.
-        messages = _validate_extension(data)
-        if messages:
-            msg = '"%s" is not a valid extension:\n%s'
-            raise ValueError(msg % (extension, '\n'.join(messages)))
-
-        # Verify package compatibility.
-        core_data = _get_core_data()
-        deps = data.get('dependencies', dict())
-        errors = _validate_compatibility(extension, deps, core_data)
-        if errors:
-            msg = _format_compatibility_errors(
-                data['name'], data['version'], errors
-            )
-            raise ValueError(msg)
+        # Only write the indexes into an existing settings directory.
+        settings = pjoin(self.app_dir, 'settings')
+        if not osp.exists(settings):
+            return
 
-        # Move the file to the app directory.
-        target = pjoin(self.app_dir, 'extensions', info['filename'])
-        if osp.exists(target):
-            os.remove(target)
+        for name in dirty:
+            index = self._indexes[name]
+            for path in [p for p in index if not osp.exists(p)]:
+                del index[path]
 
-        shutil.move(info['path'], target)
+            target = pjoin(settings, name + '.json')
+            try:
+                with open(target, 'w') as fid:
+                    json.dump(index, fid)
+            except (IOError, OSError) as e:
+                self.logger.debug('Could not write index %s: %s' % (name, e))
 
-        info['path'] = target
-        return info
+    def _get_local_data(self, source):
+        """Get the local data for extensions or linked packages.
+        """
+        def get_dead(config):
+            data = config.get(source, dict())
+            return [name for (name, path) in data.items()
+                    if not osp.exists(path)]
+
+        if get_dead(self._read_build_config()):
+            with self._build_config.transaction():
+                config = self._read_build_config()
+                dead = get_dead(config)
+                for name in dead:
+                    link_type = source.replace('_', ' ')
+                    msg = '**Note: Removing dead %s "%s"' % (link_type, name)
+                    self.logger.warn(msg)
+                    del config[source][name]
+
+                if dead:
+                    self._write_build_config(config)
 
-    def _extract_package(self, source, tempdir):
-        # npm pack the extension
-        is_dir = osp.exists(source) and osp.isdir(source)
-        if is_dir and not osp.exists(pjoin(source, 'node_modules')):
-            self._run(['node', YARN_PATH, 'install'], cwd=source)
+        return dict(self._read_build_config().get(source, dict()))
 
-        info = dict(source=source, is_dir=is_dir)
+    def _install_extensions(self, extensions, tempdir):
+        """Install extensions with validation and return their info.
 
-        ret = self._run([which('npm'), 'pack', source], cwd=tempdir)
-        if ret != 0:
-            msg = '"%s" is not a valid npm package'
-            raise ValueError(msg % source)
+        The extensions are packed concurrently and none are installed
+        unless all of them are valid.
+        """
+        def extract(index, extension, logger):
+            path = pjoin(tempdir, str(index))
+            os.makedirs(path)
+            return self._extract_package(extension, path, logger=logger)
+
+        infos = self._run_workers(extract, list(enumerate(extensions)))
+
+        core_data = self.info['core_data']
+        messages = []
+        for (extension, info) in zip(extensions, infos):
+            data = info['data']
+
+            # Verify that the package is an extension.
+            if info['messages']:
+                msg = '"%s" is not a valid extension:\n%s'
+                messages.append(msg % (extension, '\n'.join(info['messages'])))
+                continue
+
+            # Verify package compatibility.
+            deps = data.get('dependencies', dict())
+            errors = _validate_compatibility(extension, deps, core_data)
+            if errors:
+                messages.append(_format_compatibility_errors(
+                    data['name'], data['version'], errors
+                ))
+
+        if messages:
+            raise ValueError('\n'.join(messages))
+
+        # Move the files to the app directory.
+        installed = dict()
+        for info in infos:
+            target = pjoin(self.app_dir, 'extensions', info['filename'])
+            if osp.exists(target):
+                os.remove(target)
+
+            # Keep only the last of several packages with the same name.
+            other = installed.get(info['name'])
+            if other and other['path'] != target:
+                os.remove(other['path'])
+
+            shutil.move(info['path'], target)
+            info['path'] = target
+            installed[info['name']] = info
+            self._add_to_extension_index(target, info)
 
-        path = glob.glob(pjoin(tempdir, '*.tgz'))[0]
-        info['data'] = _read_package(path)
+        self._write_indexes()
+        return list(installed.values())
+
+    def _extract_package(self, source, tempdir, logger=None):
+        """Pack a package into a temporary directory and inspect it.
+        """
+        logger = logger or self.logger
+        is_dir = osp.exists(source) and osp.isdir(source)
+        info = dict(source=source, is_dir=is_dir)
         if is_dir:
-            info['sha'] = sha = _tarsum(path)
-            target = path.replace('.tgz', '-%s.tgz' % sha)
+            fingerprint = _fingerprint(source)
+
+        # Pack local directories in process when npm is not needed.
+        path = None
+        if is_dir and osp.exists(pjoin(source, 'package.json')):
+            try:
+                path = pack_directory(source, tempdir)
+            except (IOError, OSError, ValueError) as e:
+                logger.debug('Falling back to npm pack: %s' % e)
+
+        if not path:
+            # The install runs the lifecycle scripts of the source.
+            if is_dir and not osp.exists(pjoin(source, 'node_modules')):
+                self._run(['node', YARN_PATH, 'install'], cwd=source,
+                          logger=logger, capture=True)
+            path = self._npm_pack(source, tempdir, logger)
+            # The lifecycle scripts may write into the source.
+            if is_dir:
+                fingerprint = _fingerprint(source)
+
+        info.update(_inspect_package(path))
+        if is_dir:
+            target = path.replace('.tgz', '-%s.tgz' % info['sha'])
             shutil.move(path, target)
             info['path'] = target
+            filename = osp.basename(target)
+            self._set_fingerprinted(source, fingerprint, filename)
         else:
             info['path'] = path
 
@@ -995,6 +1483,17 @@ class _AppHandler(object):
 
         return info
 
+    def _npm_pack(self, source, tempdir, logger):
+        """Pack a package using npm and return the tarball path.
+        """
+        ret = self._run([which('npm'), 'pack', source], cwd=tempdir,
+                        logger=logger, capture=True)
+        if ret != 0:
+            msg = '"%s" is not a valid npm package'
+            raise ValueError(msg % source)
+
+        return glob.glob(pjoin(tempdir, '*.tgz'))[0]
+
     def _run(self, cmd, **kwargs):
         """Run the command using our logger and abort callback.
         Returns the exit code.
@@ -1002,10 +1501,335 @@ class _AppHandler(object):
         if self.kill_event.is_set():
             raise ValueError('Command was killed')
 
-        kwargs['logger'] = self.logger
+        kwargs.setdefault('logger', self.logger)
         kwargs['kill_event'] = self.kill_event
-        proc = Process(cmd, **kwargs)
+        kwargs['group'] = self.app_dir
+        kwargs['priority'] = self.priority
+        if self.loop is not None and not kwargs.get('capture'):
+            kwargs['loop'] = self.loop
+        elif self.stream and not kwargs.get('capture'):
+            kwargs['stream'] = True
+        return _run_command(cmd, stats=self.process_stats, **kwargs)
+
+
+class _ConfigStore(object):
+    """A json config file with an in-memory copy.
+
+    Writes in a transaction are deferred to its end, when the file is
+    replaced atomically.  Transactions hold an advisory lock on the file
+    where `fcntl` is available.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+        self._stat = None
+        self._dirty = False
+        self._depth = 0
+        self._lock_fid = None
+
+    def read(self):
+        """Get the config data.
+        """
+        if self._data is None:
+            self._load()
+        return self._data
+
+    def write(self, data):
+        """Set the config data.
+        """
+        self._data = data
+        self._dirty = True
+        if not self._depth:
+            self._lock()
+            try:
+                self._flush()
+            finally:
+                self._unlock()
+
+    @contextmanager
+    def transaction(self):
+        """Lock the file and write the changes once at the end.
+
+        The data is loaded again if the file changed since it was read,
+        and changes are discarded if the transaction fails.
+        """
+        if not self._depth:
+            self._lock()
+            if self._data is None or self._stat != self._get_stat():
+                self._load()
+
+        self._depth += 1
+        try:
+            yield self.read()
+        except Exception:
+            if self._depth == 1:
+                self._data = None
+                self._dirty = False
+            raise
+        finally:
+            self._depth -= 1
+            if not self._depth:
+                try:
+                    self._flush()
+                finally:
+                    self._unlock()
+
+    def _get_stat(self):
+        if osp.exists(self.path):
+            return _stat_key(self.path)
+
+    def _load(self):
+        self._stat = self._get_stat()
+        self._data = dict()
+        if self._stat:
+            with open(self.path) as fid:
+                self._data = json.load(fid)
+
+    def _flush(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+
+        temp = '%s.%s.tmp' % (self.path, os.getpid())
+        with open(temp, 'w') as fid:
+            json.dump(self._data, fid, indent=4)
+        if os.name == 'nt' and osp.exists(self.path):
+            os.remove(self.path)
+        os.rename(temp, self.path)
+        self._stat = self._get_stat()
+
+    def _lock(self):
+        dname = osp.dirname(self.path)
+        if not fcntl or not osp.exists(dname):
+            return
+        self._lock_fid = open(self.path + '.lock', 'a')
+        fcntl.flock(self._lock_fid, fcntl.LOCK_EX)
+
+    def _unlock(self):
+        if not self._lock_fid:
+            return
+        fcntl.flock(self._lock_fid, fcntl.LOCK_UN)
+        self._lock_fid.close()
+        self._lock_fid = None
+
+
+class _LoggerProxy(object):
+    """A base for objects that stand in for a logger.
+
+    The logging methods call `_log` with the method name and arguments.
+    """
+    _methods = ['debug', 'info', 'warn', 'warning', 'error']
+
+    def __getattr__(self, method):
+        if method not in self._methods:
+            raise AttributeError(method)
+
+        def log(msg, *args, **kwargs):
+            self._log(method, msg, args, kwargs)
+        return log
+
+    def _log(self, method, msg, args, kwargs):
+        raise NotImplementedError
+
+
+class _BufferedLogger(_LoggerProxy):
+    """A logger that buffers its messages to replay them later.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def _log(self, method, msg, args, kwargs):
+        self.records.append((method, msg, args, kwargs))
+
+    def replay(self, logger):
+        """Replay the buffered messages on a logger.
+        """
+        for (method, msg, args, kwargs) in self.records:
+            getattr(logger, method)(msg, *args, **kwargs)
+        self.records = []
+
+
+class _AppInfo(dict):
+    """Information about an app whose fields are computed on first access.
+    """
+
+    def __init__(self):
+        super(_AppInfo, self).__init__()
+        self._loaders = dict()
+
+    def add_loader(self, key, loader):
+        """Add a function used to compute the value of a field.
+        """
+        self._loaders[key] = loader
+
+    def load(self):
+        """Compute all of the fields and return them as a dictionary.
+        """
+        return dict((key, self[key]) for key in self._loaders)
+
+    def __missing__(self, key):
+        if key not in self._loaders:
+            raise KeyError(key)
+        value = self[key] = self._loaders[key]()
+        return value
+
+
+def _get_pack_workers():
+    """Get the number of workers used to pack local dependencies.
+
+    Configured with the QUANTLAB_PACK_WORKERS environment variable.
+    """
+    workers = os.environ.get('QUANTLAB_PACK_WORKERS')
+    if workers:
+        return max(int(workers), 1)
+    try:
+        return min(multiprocessing.cpu_count(), 8)
+    except NotImplementedError:
+        return 1
+
+
+def _run_command(cmd, stats=None, loop=None, **kwargs):
+    """Run a command in the Node worker if enabled, or in a subprocess.
+
+    The subprocess runs as an `AsyncProcess` on `loop` if given, which
+    must not be the IOLoop of the current thread.  Appends the stats
+    record of the command to `stats` if given and returns the exit code.
+    """
+    worker = NodeWorker.instance()
+    if worker is not None:
+        env = kwargs.get('env')
+        if len(cmd) > 1 and cmd[1] == YARN_PATH:
+            # The yarn-path of the staging .yarnrc is a copy of this script,
+            # run it directly instead of in another process.
+            env = dict(env or os.environ, YARN_IGNORE_PATH='1')
+        record = worker.run(cmd, cwd=kwargs.get('cwd'), env=env,
+                            logger=kwargs.get('logger'),
+                            kill_event=kwargs.get('kill_event'),
+                            group=kwargs.get('group'),
+                            priority=kwargs.get('priority', PRIORITY_NORMAL))
+        if record is not None:
+            if stats is not None:
+                stats.append(record)
+            return record['returncode']
+
+    if loop is not None:
+        if os.name != 'nt':
+            return _run_on_loop(cmd, loop, stats, **kwargs)
+        kwargs['stream'] = True
+
+    proc = Process(cmd, **kwargs)
+    try:
         return proc.wait()
+    finally:
+        if stats is not None and proc.stats:
+            stats.append(proc.stats)
+
+
+def _run_on_loop(cmd, loop, stats=None, **kwargs):
+    """Run a command as an `AsyncProcess` on an IOLoop and wait for it.
+
+    Appends the stats record of the command to `stats` if given and
+    returns the exit code.
+    """
+    done = futures.Future()
+
+    @gen.coroutine
+    def run():
+        proc = AsyncProcess(cmd, **kwargs)
+        try:
+            code = yield proc.wait_async()
+        finally:
+            if stats is not None and proc.stats:
+                stats.append(proc.stats)
+        raise gen.Return(code)
+
+    loop.add_callback(lambda: chain_future(run(), done))
+    return done.result()
+
+
+def _get_build_cache_size(logger=None):
+    """Get the maximum size in bytes of the build cache.
+
+    Configured in megabytes with the QUANTLAB_BUILD_CACHE_SIZE
+    environment variable, where 0 disables the cache.
+    """
+    size = os.environ.get('QUANTLAB_BUILD_CACHE_SIZE',
+                          str(DEFAULT_BUILD_CACHE_SIZE))
+    try:
+        size = int(size)
+    except ValueError:
+        logger = logger or logging.getLogger('quantlab')
+        logger.warn('Invalid QUANTLAB_BUILD_CACHE_SIZE "%s", using %s MB' %
+                    (size, DEFAULT_BUILD_CACHE_SIZE))
+        size = DEFAULT_BUILD_CACHE_SIZE
+    return size * 1024 * 1024
+
+
+def _get_build_manifest(staging, command, shas):
+    """Get the hash of the staging inputs of a build.
+
+    The yarn.lock file is written by the install, so it is stored with a
+    cached build instead of being part of its manifest.
+    """
+    fnames = ['package.json', 'index.js', 'webpack.config.js', '.yarnrc',
+              'yarn.js']
+    return _hash_inputs(staging, fnames, shas, command)
+
+
+def _get_install_stamp(path, shas):
+    """Get the hash of the installed dependency manifest in a directory.
+
+    Includes the yarn integrity file so that a missing or different
+    install of node_modules is detected.
+    """
+    fnames = ['package.json', 'yarn.lock', 'node_modules/.yarn-integrity']
+    return _hash_inputs(path, fnames, shas)
+
+
+def _hash_inputs(path, fnames, shas, prefix=''):
+    """Hash files of a directory with its linked packages and the shas of
+    its `file:` dependency tarballs from `_AppHandler._get_file_shas`.
+    """
+    sha = hashlib.sha1(prefix.encode('utf-8'))
+    sha.update(json.dumps(sorted(shas.items())).encode('utf-8'))
+    fnames = list(fnames)
+    linked = pjoin(path, 'linked_packages')
+    if osp.exists(linked):
+        fnames += sorted(
+            'linked_packages/' + fname for fname in os.listdir(linked)
+        )
+
+    for fname in fnames:
+        target = pjoin(path, fname)
+        if not osp.isfile(target):
+            continue
+        sha.update(fname.encode('utf-8'))
+        with open(target, 'rb') as fid:
+            sha.update(hashlib.sha1(fid.read()).digest())
+    return sha.hexdigest()
+
+
+def _evict_build_cache(cache_dir, max_size):
+    """Remove the least recently used builds over the cache size.
+    """
+    entries = []
+    for fname in os.listdir(cache_dir):
+        path = pjoin(cache_dir, fname)
+        if fname.endswith('.tmp'):
+            continue
+        size = 0
+        for (root, _, fnames) in os.walk(path):
+            size += sum(osp.getsize(pjoin(root, f)) for f in fnames)
+        entries.append((os.stat(path).st_mtime, size, path))
+
+    total = sum(size for (_, size, _) in entries)
+    for (_, size, path) in sorted(entries):
+        if total <= max_size:
+            break
+        shutil.rmtree(path, True)
+        total -= size
 
 
 def _normalize_path(extension):
@@ -1017,17 +1841,72 @@ def _normalize_path(extension):
     return extension
 
 
-def _read_package(target):
-    """Read the package data in a given target tarball.
+def _stat_key(path):
+    """Get the key used to detect changes to a file in an index.
     """
-    tar = tarfile.open(target, "r:gz")
-    f = tar.extractfile('package/package.json')
-    data = json.loads(f.read().decode('utf8'))
-    data['quantlab_extracted_files'] = [
-        f.path[len('package/'):] for f in tar.getmembers()
-    ]
-    tar.close()
-    return data
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime, stat.st_ino]
+
+
+def _fingerprint(source):
+    """Get a fingerprint of the files in a local source from their stat info.
+
+    Dependency and version control directories are not included.
+    """
+    sha = hashlib.sha1()
+    if not osp.isdir(source):
+        sha.update(json.dumps(_stat_key(source)).encode('utf-8'))
+        return sha.hexdigest()
+
+    for (root, dnames, fnames) in os.walk(source):
+        dnames[:] = sorted(d for d in dnames
+                           if d not in ['node_modules', '.git'])
+        for fname in sorted(fnames):
+            path = pjoin(root, fname)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            item = [osp.relpath(path, source), stat.st_size, stat.st_mtime]
+            sha.update(json.dumps(item).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def _inspect_package(target):
+    """Inspect a package tarball in a single streaming pass.
+
+    Returns a dictionary with the package data including the extracted
+    file manifest, the sha of the file contents, and any problems with
+    the package as an extension.
+    """
+    chunk_size = 100 * 1024
+    h = hashlib.new("sha1")
+    files = []
+    data = None
+
+    with tarfile.open(target, "r|gz") as tar:
+        for member in tar:
+            files.append(member.path[len('package/'):])
+            if not member.isfile():
+                continue
+            is_package = member.path == 'package/package.json'
+            content = []
+            f = tar.extractfile(member)
+            chunk = f.read(chunk_size)
+            while chunk:
+                h.update(chunk)
+                if is_package:
+                    content.append(chunk)
+                chunk = f.read(chunk_size)
+            if is_package:
+                data = json.loads(b''.join(content).decode('utf8'))
+
+    if data is None:
+        raise ValueError('"%s" does not contain a package.json' % target)
+
+    data['quantlab_extracted_files'] = files
+    return dict(data=data, sha=h.hexdigest(),
+                messages=_validate_extension(data))
 
 
 def _validate_extension(data):
@@ -1076,30 +1955,56 @@ def _validate_extension(data):
     return messages
 
 
-def _tarsum(input_file):
+def _get_core_data():
+    """Get a read-only snapshot of the data for the app template.
+
+    The template is parsed again only when its file changes.  Use
+    `_thaw` to get a mutable copy.
     """
-    Compute the recursive sha sum of a tar file.
+    path = pjoin(HERE, 'staging', 'package.json')
+    key = _stat_key(path)
+    cached = _core_data_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    with open(path) as fid:
+        data = _freeze(json.load(fid))
+    _core_data_cache[path] = (key, data)
+    return data
+
+
+_core_data_cache = dict()
+
+
+class _FrozenDict(dict):
+    """A dictionary that cannot be modified.
     """
-    tar = tarfile.open(input_file, "r:gz")
-    chunk_size = 100 * 1024
-    h = hashlib.new("sha1")
 
-    for member in tar:
-        if not member.isfile():
-            continue
-        f = tar.extractfile(member)
-        data = f.read(chunk_size)
-        while data:
-            h.update(data)
-            data = f.read(chunk_size)
-    return h.hexdigest()
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('Cannot modify read-only data')
 
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
 
-def _get_core_data():
-    """Get the data for the app template.
+
+def _freeze(obj):
+    """Get a read-only copy of json data.
     """
-    with open(pjoin(HERE, 'staging', 'package.json')) as fid:
-        return json.load(fid)
+    if isinstance(obj, dict):
+        return _FrozenDict((k, _freeze(v)) for (k, v) in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return tuple(_freeze(v) for v in obj)
+    return obj
+
+
+def _thaw(obj):
+    """Get a mutable copy of json data.
+    """
+    if isinstance(obj, dict):
+        return dict((k, _thaw(v)) for (k, v) in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return [_thaw(v) for v in obj]
+    return obj
 
 
 def _validate_compatibility(extension, deps, core_data):
@@ -1112,60 +2017,28 @@ def _validate_compatibility(extension, deps, core_data):
 
     for (key, value) in deps.items():
         if key in singletons:
-            overlap = _test_overlap(core_deps[key], value)
-            if overlap is False:
+            if not _test_overlap(core_deps[key], value):
                 errors.append((key, core_deps[key], value))
 
     return errors
 
 
+def _get_compat_key(core_data):
+    """Get the key of the core data used to validate compatibility.
+    """
+    core_deps = core_data['dependencies']
+    singletons = core_data['quantlab']['singletonPackages']
+    specs = sorted((name, core_deps.get(name)) for name in singletons)
+    data = [COMPAT_VERSION, core_data['quantlab']['version'], specs]
+    return hashlib.sha1(json.dumps(data).encode('utf-8')).hexdigest()
+
+
 def _test_overlap(spec1, spec2):
     """Test whether two version specs overlap.
-    Returns `None` if we cannot determine compatibility,
-    otherwise whether there is an overlap
-    """
-    # Test for overlapping semver ranges.
-    r1 = Range(spec1, True)
-    r2 = Range(spec2, True)
-
-    # If either range is empty, we cannot verify.
-    if not r1.range or not r2.range:
-        return
-
-    x1 = r1.set[0][0].semver
-    x2 = r1.set[0][-1].semver
-    y1 = r2.set[0][0].semver
-    y2 = r2.set[0][-1].semver
-
-    o1 = r1.set[0][0].operator
-    o2 = r2.set[0][0].operator
-
-    # We do not handle (<) specifiers.
-    if (o1.startswith('<') or o2.startswith('<')):
-        return
-
-    # Handle single value specifiers.
-    lx = lte if x1 == x2 else lt
-    ly = lte if y1 == y2 else lt
-    gx = gte if x1 == x2 else gt
-    gy = gte if x1 == x2 else gt
-
-    # Handle unbounded (>) specifiers.
-    def noop(x, y, z):
-        return True
 
-    if x1 == x2 and o1.startswith('>'):
-        lx = noop
-    if y1 == y2 and o2.startswith('>'):
-        ly = noop
-
-    # Check for overlap.
-    return (
-        gte(x1, y1, True) and ly(x1, y2, True) or
-        gy(x2, y1, True) and ly(x2, y2, True) or
-        gte(y1, x1, True) and lx(y1, x2, True) or
-        gx(y2, x1, True) and lx(y2, x2, True)
-    )
+    Specs that are not semver ranges match any version.
+    """
+    return intersects(spec1, spec2, True)
 
 
 def _is_disabled(name, disabled=[]):
@@ -1187,8 +2060,8 @@ def _format_compatibility_errors(name, version, errors):
     l1 = 10
     for error in errors:
         pkg, jlab, ext = error
-        jlab = str(Range(jlab, True))
-        ext = str(Range(ext, True))
+        jlab = str(make_range(jlab, True))
+        ext = str(make_range(ext, True))
         msgs.append((pkg, jlab, ext))
         l0 = max(l0, len(pkg) + 1)
         l1 = max(l1, len(jlab) + 1)
@@ -29,7 +29,10 @@ def load_jupyter_server_extension(nbapp):
     from quantlab_launcher import add_handlers, QuantLabConfig
     from notebook.utils import url_path_join as ujoin
     from tornado.ioloop import IOLoop
-    from .build_handler import build_path, Builder, BuildHandler
+    from .build_handler import (
+        build_path, build_events_path, Builder, BuildHandler,
+        BuildEventsHandler
+    )
     from .commands import (
         get_app_dir, get_user_settings_dir, watch, ensure_dev, watch_dev,
         pjoin, DEV_DIR, HERE, get_app_version
@@ -127,5 +130,8 @@ def load_jupyter_server_extension(nbapp):
     build_url = ujoin(base_url, build_path)
     builder = Builder(logger, core_mode, app_dir)
     build_handler = (build_url, BuildHandler, {'builder': builder})
+    build_events_url = ujoin(base_url, build_events_path)
+    build_events_handler = (build_events_url, BuildEventsHandler,
+                            {'builder': builder})
 
-    web_app.add_handlers(".*$", [build_handler])
+    web_app.add_handlers(".*$", [build_handler, build_events_handler])
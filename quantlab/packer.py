@@ -0,0 +1,536 @@
+# coding: utf-8
+"""An in-process packer for local npm package directories.
+
+The file selection follows the rules used by `npm pack`: the `files` field
+of the `package.json`, `.npmignore` and `.gitignore` files, and the files
+that npm always includes or excludes.  The tarball entries are written the
+way `npm pack` writes them, so the uncompressed archive is byte-identical
+to the one of npm 10 and reproducible across runs.
+
+Packages that need npm itself, such as those with `prepack` or `prepare`
+lifecycle scripts or bundled dependencies, are not handled here and
+`pack_directory` returns `None` for them.
+"""
+
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+from __future__ import print_function
+
+import io
+import json
+import os
+import os.path as osp
+import re
+import stat
+import zlib
+
+
+# The lifecycle scripts that `npm pack` runs, and those that the yarn
+# install of a source directory runs, which may build the packed files.
+LIFECYCLE_SCRIPTS = ['prepack', 'prepare', 'postpack', 'prepublish',
+                     'preinstall', 'install', 'postinstall']
+
+# The fixed mtime `npm pack` uses for all entries, 1985-10-26T08:15:00Z.
+NPM_MTIME = 499162500
+
+# The rules applied to every directory.
+DEFAULT_RULES = [
+    '.npmignore',
+    '.gitignore',
+    '**/.git',
+    '**/.svn',
+    '**/.hg',
+    '**/CVS',
+    '**/.git/**',
+    '**/.svn/**',
+    '**/.hg/**',
+    '**/CVS/**',
+    '/.lock-wscript',
+    '/.wafpickle-*',
+    '/build/config.gypi',
+    'npm-debug.log',
+    '**/.npmrc',
+    '.*.swp',
+    '.DS_Store',
+    '**/.DS_Store/**',
+    '._*',
+    '**/._*/**',
+    '*.orig',
+    '/archived-packages/**',
+]
+
+# The rules applied after all others in the package root.
+STRICT_RULES = [
+    '/.git',
+    '!/package.json',
+    '!/readme{,.*[^~$]}',
+    '!/copying{,.*[^~$]}',
+    '!/license{,.*[^~$]}',
+    '!/licence{,.*[^~$]}',
+    '/.git',
+    '/node_modules',
+    '.npmrc',
+    '/package-lock.json',
+    '/yarn.lock',
+    '/pnpm-lock.yaml',
+]
+
+
+def pack_directory(source, dest_dir):
+    """Pack a local package directory into a tarball in a given directory.
+
+    Returns the path to the tarball, or `None` if the package must be
+    packed by npm.
+    """
+    with open(osp.join(source, 'package.json')) as fid:
+        data = json.load(fid)
+
+    if not _can_pack(data):
+        return None
+
+    members = []
+    for name in get_package_files(source, data):
+        header = _tar_header('package/' + name, source, data)
+        if header is None:
+            return None
+        members.append((header, osp.join(source, name)))
+
+    filename = '%s-%s.tgz' % (
+        data['name'].lstrip('@').replace('/', '-', 1), data['version']
+    )
+    target = osp.join(dest_dir, filename)
+
+    try:
+        with open(target, 'wb') as fid:
+            _write_tarball(fid, members)
+    except Exception:
+        os.remove(target)
+        raise
+    return target
+
+
+def get_package_files(source, data=None):
+    """Get the sorted relative paths of the files npm would pack.
+    """
+    if data is None:
+        with open(osp.join(source, 'package.json')) as fid:
+            data = json.load(fid)
+
+    walker = _Walker(source, data)
+    return sorted(walker.walk(), key=_sort_key)
+
+
+class _Rule(object):
+    """A single minimatch-style ignore rule.
+    """
+
+    def __init__(self, pattern):
+        negate = False
+        while pattern.startswith('!'):
+            negate = not negate
+            pattern = pattern[1:]
+        self.negate = negate
+        pattern = re.sub('/+', '/', pattern)
+        self.sets = [
+            [_compile_part(p) for p in expanded.split('/')]
+            for expanded in _expand_braces(pattern)
+        ]
+
+    @property
+    def is_relative(self):
+        """Whether the rule only has a single path part.
+        """
+        return any(
+            len(parts) <= (1 if parts[-1] != '' else 2) for parts in self.sets
+        )
+
+    def match(self, path, partial=False):
+        """Test whether a path matches the rule.
+        """
+        segments = path.split('/')
+        basename = ''
+        for segment in reversed(segments):
+            if segment:
+                basename = segment
+                break
+        for parts in self.sets:
+            target = [basename] if len(parts) == 1 else segments
+            if _match_parts(target, parts, partial):
+                return True
+        return False
+
+
+class _Walker(object):
+    """Walk a package directory applying the npm ignore rules.
+    """
+
+    def __init__(self, root, data):
+        self.root = root
+        self.data = data
+        self.required = []
+        self.package_rules = None
+        self.strict_rules = self._get_strict_rules()
+
+    def walk(self):
+        """Get the relative paths of the included files.
+        """
+        result = []
+        self._walk_dir('', [], True, result)
+        return result
+
+    def _walk_dir(self, rel, parents, exact, result):
+        path = osp.join(self.root, rel) if rel else self.root
+        entries = os.listdir(path)
+        is_root = not rel
+
+        rules = [[_Rule(r) for r in DEFAULT_RULES]]
+        if is_root and self.package_rules is not None:
+            rules.append(self.package_rules)
+        elif '.npmignore' in entries:
+            rules.append(_read_rules(osp.join(path, '.npmignore')))
+        elif '.gitignore' in entries:
+            rules.append(_read_rules(osp.join(path, '.gitignore')))
+
+        if is_root:
+            rules.append(self.strict_rules)
+        else:
+            strict = ['/.git']
+            prefix = rel + '/'
+            strict += ['!' + f[len(prefix):] for f in self.required
+                       if f.startswith(prefix)]
+            rules.append([_Rule(r) for r in strict])
+
+        levels = parents + [(osp.basename(rel), rules, exact)]
+
+        for entry in sorted(entries):
+            entry_path = osp.join(path, entry)
+            st = os.lstat(entry_path)
+            is_dir = stat.S_ISDIR(st.st_mode)
+            if not is_dir and not stat.S_ISREG(st.st_mode):
+                continue
+            # npm refuses to pack names with wildcards.
+            if '*' in entry:
+                continue
+            entry_rel = rel + '/' + entry if rel else entry
+            included = _filter(levels, entry)
+            if not is_dir:
+                if included:
+                    result.append(entry_rel)
+            elif _filter(levels, entry, partial=True):
+                exact = included or _filter(levels, entry + '/')
+                self._walk_dir(entry_rel, levels, exact, result)
+
+    def _get_strict_rules(self):
+        """Get the strict rules for the package root.
+
+        This also sets up the rules from the `files` field.
+        """
+        data = self.data
+        strict = list(STRICT_RULES)
+        files = data.get('files')
+
+        if files is not None:
+            ignores = []
+            for fname in files:
+                if fname.startswith('./'):
+                    fname = fname[1:]
+                if fname.endswith('/*'):
+                    fname += '*'
+                inverse = '!' + fname
+                path = osp.join(self.root, fname.lstrip('!').lstrip('/'))
+                if osp.isfile(path) and not osp.islink(path):
+                    strict.insert(0, inverse)
+                    self.required.append(fname.lstrip('/'))
+                elif osp.isdir(path) and not osp.islink(path):
+                    ignores.append(inverse)
+                    ignores.append(inverse + '/**')
+                elif not osp.lexists(path):
+                    ignores.append(inverse)
+            self.package_rules = [_Rule(r) for r in ['*'] + ignores]
+
+        if data.get('browser') and not isinstance(data['browser'], dict):
+            strict.append('!/' + data['browser'])
+        if data.get('main'):
+            strict.append('!/' + data['main'])
+        for path in _get_bins(data).values():
+            strict.append('!/' + path)
+
+        return [_Rule(r) for r in strict]
+
+
+def _can_pack(data):
+    """Test whether a package can be packed without npm.
+    """
+    scripts = data.get('scripts', dict())
+    if any(name in scripts for name in LIFECYCLE_SCRIPTS):
+        return False
+    if data.get('bundleDependencies') or data.get('bundledDependencies'):
+        return False
+    return 'name' in data and 'version' in data
+
+
+def _filter(levels, entry, partial=False):
+    """Test whether an entry is included given the rules of its parents.
+
+    Mirrors the recursive filtering of `ignore-walk`, where each parent
+    directory tests the entry relative to itself before the rules of the
+    directory containing the entry are applied.
+    """
+    paths = []
+    path = entry
+    for (name, _, _) in reversed(levels):
+        paths.append(path)
+        path = name + '/' + path
+    paths.reverse()
+
+    included = True
+    last = len(levels) - 1
+    for (index, (_, rule_sets, exact)) in enumerate(levels):
+        if index and not included and not exact:
+            return False
+        basename = None if index == last else entry
+        for rules in rule_sets:
+            for rule in rules:
+                if rule.negate == included:
+                    continue
+                if _rule_matches(rule, paths[index], partial, basename):
+                    included = rule.negate
+    return included
+
+
+def _rule_matches(rule, entry, partial, basename):
+    """Test a rule against an entry the way `ignore-walk` does.
+    """
+    if rule.match('/' + entry) or rule.match(entry):
+        return True
+    if not partial:
+        return False
+    if rule.match('/' + entry + '/') or rule.match(entry + '/'):
+        return True
+    if rule.negate and (rule.match('/' + entry, True) or
+                        rule.match(entry, True)):
+        return True
+    if basename and rule.is_relative:
+        if rule.match('/' + basename + '/') or rule.match(basename + '/'):
+            return True
+        if rule.negate and (rule.match('/' + basename, True) or
+                            rule.match(basename, True)):
+            return True
+    return False
+
+
+def _read_rules(path):
+    """Read the rules in an ignore file.
+    """
+    with io.open(path, encoding='utf-8') as fid:
+        lines = fid.read().splitlines()
+    return [_Rule(line.strip()) for line in lines
+            if line.strip() and not line.strip().startswith('#')]
+
+
+_GLOBSTAR = object()
+
+
+def _compile_part(part):
+    """Compile one path part of a glob pattern.
+    """
+    if part == '**':
+        return _GLOBSTAR
+    if not re.search(r'[*?\[]', part):
+        return part.lower()
+
+    regex = ''
+    i = 0
+    while i < len(part):
+        char = part[i]
+        if char == '*':
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '[':
+            end = part.find(']', i + 2)
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                body = part[i + 1:end]
+                if body[0] in '!^':
+                    body = '^' + body[1:]
+                regex += '[' + body.replace('\\', '\\\\') + ']'
+                i = end
+        else:
+            regex += re.escape(char)
+        i += 1
+    return re.compile('^' + regex + '$', re.IGNORECASE | re.DOTALL)
+
+
+def _match_part(segment, part):
+    if hasattr(part, 'match'):
+        return part.match(segment) is not None
+    return segment.lower() == part
+
+
+def _match_parts(segments, parts, partial):
+    """Match path segments against compiled pattern parts.
+    """
+    fi = 0
+    pi = 0
+    fl = len(segments)
+    pl = len(parts)
+    while fi < fl and pi < pl:
+        part = parts[pi]
+        if part is _GLOBSTAR:
+            if pi == pl - 1:
+                return all(s not in ('.', '..') for s in segments[fi:])
+            for fr in range(fi, fl):
+                if _match_parts(segments[fr:], parts[pi + 1:], partial):
+                    return True
+                if segments[fr] in ('.', '..'):
+                    break
+            return partial
+        if not _match_part(segments[fi], part):
+            return False
+        fi += 1
+        pi += 1
+
+    if fi == fl and pi == pl:
+        return True
+    if fi == fl:
+        return partial
+    return fi == fl - 1 and segments[fi] == ''
+
+
+def _expand_braces(pattern):
+    """Expand the comma separated brace sets in a pattern.
+    """
+    match = re.search(r'\{([^{}]*,[^{}]*)\}', pattern)
+    if not match:
+        return [pattern]
+    results = []
+    for option in match.group(1).split(','):
+        expanded = pattern[:match.start()] + option + pattern[match.end():]
+        results.extend(_expand_braces(expanded))
+    return results
+
+
+def _get_bins(data):
+    """Get the bin files of a package.
+    """
+    bins = data.get('bin')
+    if not bins:
+        return dict()
+    if isinstance(bins, dict):
+        return bins
+    return {data['name'].split('/')[-1]: bins}
+
+
+def _sort_key(path):
+    """The sort order `npm pack` uses to group similar files.
+    """
+    base = path.split('/')[-1].lower()
+    ext = osp.splitext(base)[1]
+    return (ext, base, path)
+
+
+def _tar_header(name, source, data):
+    """Create the ustar header for a file in the way node-tar does.
+
+    Like npm, files keep their permissions without group and other write
+    bits, and the files of `bin` entries are made executable.  Returns
+    `None` for paths that would need a pax header.
+    """
+    path = osp.join(source, name[len('package/'):])
+    st = os.stat(path)
+
+    mode = ((st.st_mode & 0o7777) | 0o600) & ~0o22
+    bins = [osp.normpath(p) for p in _get_bins(data).values()]
+    if osp.normpath(name[len('package/'):]) in bins:
+        mode |= 0o111
+
+    try:
+        encoded = name.encode('ascii')
+    except UnicodeEncodeError:
+        return None
+
+    split = _split_prefix(encoded)
+    if split is None:
+        return None
+    (fname, prefix) = split
+
+    header = bytearray(512)
+    _set_field(header, 0, 100, fname)
+    _set_field(header, 100, 8, _encode_number(mode, 8))
+    _set_field(header, 124, 12, _encode_number(st.st_size, 12))
+    _set_field(header, 136, 12, _encode_number(NPM_MTIME, 12))
+    header[156:157] = b'0'
+    _set_field(header, 257, 6, b'ustar\0')
+    _set_field(header, 263, 2, b'00')
+    _set_field(header, 329, 8, _encode_number(0, 8))
+    _set_field(header, 337, 8, _encode_number(0, 8))
+    _set_field(header, 345, 155, prefix)
+
+    # The checksum is computed with the checksum field set to spaces.
+    header[148:156] = b' ' * 8
+    _set_field(header, 148, 8, _encode_number(sum(header), 8))
+    return (bytes(header), st.st_size)
+
+
+def _split_prefix(path):
+    """Split a path into the ustar name and prefix fields.
+    """
+    if len(path) < 100:
+        return (path, b'')
+    (prefix, _, fname) = path.rpartition(b'/')
+    while True:
+        if len(fname) <= 100 and len(prefix) <= 155:
+            return (fname, prefix)
+        if len(fname) > 100 and len(prefix) <= 155:
+            return None
+        if b'/' not in prefix:
+            return None
+        (prefix, _, head) = prefix.rpartition(b'/')
+        fname = head + b'/' + fname
+
+
+def _encode_number(num, size):
+    """Encode a number as a node-tar octal header field.
+    """
+    return ('%o' % num).zfill(size - 2).encode('ascii') + b' \0'
+
+
+def _set_field(header, offset, size, value):
+    header[offset:offset + len(value)] = value[:size]
+
+
+def _write_tarball(fid, members):
+    """Write the gzipped tarball for a list of header and path pairs.
+    """
+    # Write a fixed gzip header with no mtime, the same as npm.
+    fid.write(b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff')
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    crc = 0
+    length = 0
+
+    def write(chunk):
+        fid.write(compressor.compress(chunk))
+        return zlib.crc32(chunk, crc) & 0xffffffff, length + len(chunk)
+
+    for ((header, size), path) in members:
+        crc, length = write(header)
+        with open(path, 'rb') as source:
+            remaining = size
+            while remaining > 0:
+                chunk = source.read(min(remaining, 100 * 1024))
+                if not chunk:
+                    raise ValueError('File changed while packing: %s' % path)
+                remaining -= len(chunk)
+                crc, length = write(chunk)
+        if size % 512:
+            crc, length = write(b'\0' * (512 - size % 512))
+
+    crc, length = write(b'\0' * 1024)
+    fid.write(compressor.flush())
+    fid.write(_pack_uint32(crc) + _pack_uint32(length & 0xffffffff))
+
+
+def _pack_uint32(value):
+    return bytes(bytearray([(value >> (8 * i)) & 0xff for i in range(4)]))
@@ -6,19 +6,34 @@
 from __future__ import print_function
 
 import atexit
+import itertools
+import json
 import logging
+import multiprocessing
 import os
+import os.path as osp
 import re
 import signal
 import sys
+import tempfile
 import threading
 import time
 import weakref
+from datetime import timedelta
 
 from tornado import gen
+from tornado.concurrent import Future, is_future
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.process import Subprocess
 
 from .qlpmapp import which, subprocess
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 try:
     import pty
 except ImportError:
@@ -34,6 +49,296 @@ else:
 
 logging.basicConfig(format='%(message)s', level=logging.INFO)
 
+# The interval in seconds to check the kill event while waiting.
+KILL_CHECK_INTERVAL = 0.1
+
+# The size of the output reads of a streamed process.
+READ_CHUNK_SIZE = 64 * 1024
+
+# The length of output after which a line without a newline is split.
+MAX_LINE_LENGTH = 64 * 1024
+
+# The unit of the maximum resident set size in the resource usage data.
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+# The script of the persistent Node worker.
+WORKER_PATH = osp.join(osp.dirname(osp.abspath(__file__)), 'staging',
+                       'worker.js')
+
+# The prefix of the messages of the Node worker on its stdout.
+WORKER_MARKER = '\x00quantlab-worker '
+
+# The idle time in seconds after which the Node worker checks its health.
+WORKER_CHECK_INTERVAL = 30
+
+# The time in seconds to wait for the Node worker to answer a ping.
+WORKER_PING_TIMEOUT = 10
+
+# The time in seconds to wait for the Node worker to end a canceled task.
+WORKER_CANCEL_TIMEOUT = 10
+
+# The time in seconds to wait for the Node worker to exit before killing it.
+WORKER_STOP_TIMEOUT = 5
+
+# The priority classes of scheduled processes, lower values run first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+
+# The memory in bytes assumed for a command whose peak RSS is not known.
+DEFAULT_PROCESS_MEMORY = 512 * 1024 * 1024
+
+
+class Scheduler(object):
+    """A scheduler that limits the child processes that run at once.
+
+    A process waits for a slot before it starts.  At most `slots`
+    processes run at once, and their memory, estimated from the last peak
+    RSS of the same command, stays within `memory` bytes, except that a
+    process always runs when nothing else is busy.  A long running process
+    like a watcher can give back its slot while idle and keep its memory.
+    Waiting processes start by priority class, then round robin across
+    groups such as app directories, then in order.
+
+    The queue, the memory budget and the memory estimates belong to one
+    Python process.  Schedulers with the same `lock_dir` also share their
+    slots across processes on the host, like the servers of a hub, by
+    holding a lock on one of the `slots` lock files of the directory while
+    a process runs.  Host slots are only available where `fcntl` is.
+
+    The shared scheduler is configured with the QUANTLAB_PROCESS_SLOTS
+    environment variable, which defaults to the number of CPUs, the
+    QUANTLAB_PROCESS_MEMORY environment variable in megabytes, which
+    defaults to the physical memory, where 0 disables the memory limit,
+    and the QUANTLAB_PROCESS_LOCK_DIR environment variable, which is not
+    set by default.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, slots=1, memory=0, lock_dir=None):
+        self.slots = max(slots, 1)
+        self.memory = memory
+        self.lock_dir = lock_dir if fcntl else None
+        self._cond = threading.Condition()
+        self._running = []
+        self._queue = []
+        self._estimates = dict()
+        self._served = dict()
+        self._ids = itertools.count()
+
+    @classmethod
+    def instance(cls):
+        """Get the shared scheduler.
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                lock_dir = os.environ.get('QUANTLAB_PROCESS_LOCK_DIR')
+                cls._instance = cls(_get_process_slots(),
+                                    _get_process_memory(), lock_dir)
+            return cls._instance
+
+    def acquire(self, cmd, group=None, priority=PRIORITY_NORMAL,
+                logger=None, kill_event=None):
+        """Wait for a slot to run a command.
+
+        Returns the ticket of the slot, to be released when the command
+        exits.  Logs the position of the command while it is queued.
+        """
+        with self._cond:
+            ticket = self._enqueue(cmd, group, priority)
+            position = None
+            while not self._try_start(ticket):
+                self._check_aborted(ticket, kill_event)
+                position = self._log_position(ticket, position, logger)
+                self._cond.wait(KILL_CHECK_INTERVAL)
+        return ticket
+
+    @gen.coroutine
+    def acquire_async(self, cmd, group=None, priority=PRIORITY_NORMAL,
+                      logger=None, kill_event=None):
+        """Asynchronously wait for a slot to run a command.
+
+        Like `acquire`, without blocking the IOLoop.
+        """
+        loop = IOLoop.current()
+        interval = timedelta(seconds=KILL_CHECK_INTERVAL)
+        with self._cond:
+            ticket = self._enqueue(cmd, group, priority)
+        position = None
+        while True:
+            with self._cond:
+                if self._try_start(ticket):
+                    ticket['wake'] = None
+                    break
+                self._check_aborted(ticket, kill_event)
+                position = self._log_position(ticket, position, logger)
+                woken = Future()
+                ticket['wake'] = lambda: loop.add_callback(
+                    _set_future_result, woken, None
+                )
+            try:
+                yield gen.with_timeout(interval, woken)
+            except gen.TimeoutError:
+                pass
+        raise gen.Return(ticket)
+
+    def idle(self, ticket):
+        """Give back the slot of a running ticket and keep its memory.
+
+        Used by long running processes once they are idle.
+        """
+        with self._cond:
+            ticket['idle'] = True
+            self._unlock_host_slot(ticket)
+            self._notify()
+
+    def release(self, ticket, stats=None):
+        """Release the slot of a ticket.
+
+        The peak RSS in the stats record of the command, if known, is used
+        to estimate the memory of later runs of the command.
+        """
+        with self._cond:
+            if ticket in self._running:
+                self._running.remove(ticket)
+            self._unlock_host_slot(ticket)
+            if stats and stats.get('max_rss'):
+                self._estimates[ticket['key']] = stats['max_rss']
+            self._notify()
+
+    def get_position(self, group=None):
+        """Get the best queue position of the waiting commands of a group.
+
+        Positions start at 1 for the next command to run.  Returns `None`
+        if no command of the group is waiting.
+        """
+        with self._cond:
+            positions = [i + 1 for (i, ticket) in enumerate(self._ordered())
+                         if ticket['group'] == (group or '')]
+        return positions[0] if positions else None
+
+    def status(self):
+        """Get the running and queued commands of the scheduler.
+        """
+        def info(ticket):
+            return dict(cmd=ticket['cmd'], group=ticket['group'],
+                        priority=ticket['priority'], memory=ticket['memory'],
+                        idle=ticket['idle'])
+
+        with self._cond:
+            return dict(slots=self.slots, memory=self.memory,
+                        running=[info(t) for t in self._running],
+                        queued=[info(t) for t in self._ordered()])
+
+    def _try_start(self, ticket):
+        """Start a ticket if it is next and it fits, holding the lock.
+        """
+        if self._ordered()[0] is not ticket:
+            return False
+        running = self._running
+        busy = [t for t in running if not t['idle']]
+        if busy:
+            if len(busy) >= self.slots:
+                return False
+            used = sum(t['memory'] for t in running)
+            if self.memory and used + ticket['memory'] > self.memory:
+                return False
+        if self.lock_dir:
+            ticket['host_slot'] = self._lock_host_slot()
+            if ticket['host_slot'] is None:
+                return False
+        self._queue.remove(ticket)
+        running.append(ticket)
+        ticket['start_time'] = time.time()
+        self._served[ticket['group']] = ticket['id']
+        # The next ticket may fit as well.
+        self._notify()
+        return True
+
+    def _enqueue(self, cmd, group, priority):
+        """Create a ticket for a command and queue it, holding the lock.
+        """
+        key = _get_command_key(cmd)
+        ticket = dict(id=next(self._ids), cmd=list2cmdline(cmd), key=key,
+                      group=group or '', priority=priority,
+                      memory=self._estimates.get(key, DEFAULT_PROCESS_MEMORY),
+                      start_time=None, idle=False, wake=None,
+                      host_slot=None)
+        self._queue.append(ticket)
+        return ticket
+
+    def _check_aborted(self, ticket, kill_event):
+        """Drop a queued ticket if its kill event is set, holding the lock.
+        """
+        if kill_event and kill_event.is_set():
+            self._queue.remove(ticket)
+            self._notify()
+            raise ValueError('Process aborted')
+
+    def _log_position(self, ticket, position, logger):
+        """Log the queue position of a ticket if it changed.
+
+        Returns the new position.
+        """
+        new_position = self._position(ticket)
+        if logger and new_position != position:
+            logger.info('Waiting to run, position %s in the queue',
+                        new_position)
+        return new_position
+
+    def _lock_host_slot(self):
+        """Lock a free slot file of the lock directory.
+
+        Returns the open slot file, or `None` if all of the slots are used.
+        """
+        if not osp.exists(self.lock_dir):
+            try:
+                os.makedirs(self.lock_dir)
+            except OSError:
+                # Another process made the directory.
+                pass
+        for i in range(self.slots):
+            fid = open(osp.join(self.lock_dir, 'slot-%s.lock' % i), 'a')
+            try:
+                fcntl.flock(fid, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                fid.close()
+                continue
+            return fid
+        return None
+
+    def _unlock_host_slot(self, ticket):
+        """Unlock the slot file of a ticket, if any.
+        """
+        fid, ticket['host_slot'] = ticket['host_slot'], None
+        if fid is not None:
+            fid.close()
+
+    def _notify(self):
+        """Wake the waiting tickets, holding the lock.
+        """
+        self._cond.notify_all()
+        for ticket in self._queue:
+            if ticket['wake']:
+                ticket['wake']()
+
+    def _ordered(self):
+        """Get the queued tickets in the order they would start.
+
+        Within a priority class, the group that started a command least
+        recently goes first.
+        """
+        served = self._served
+        return sorted(self._queue, key=lambda t: (
+            t['priority'], served.get(t['group'], -1), t['id']
+        ))
+
+    def _position(self, ticket):
+        """Get the queue position of a ticket, holding the lock.
+        """
+        return self._ordered().index(ticket) + 1
+
 
 class Process(object):
     """A wrapper for a child process.
@@ -42,8 +347,12 @@ class Process(object):
     _pool = None
 
     def __init__(self, cmd, logger=None, cwd=None, kill_event=None,
-                 env=None):
+                 env=None, capture=False, stream=False, group=None,
+                 priority=PRIORITY_NORMAL):
         """Start a subprocess that can be run asynchronously.
+
+        The process starts once the shared scheduler has a slot for it.
+
         Parameters
         ----------
         cmd: list
@@ -56,6 +365,16 @@ class Process(object):
             The environment for the process.
         kill_event: :class:`~threading.Event`, optional
             An event used to kill the process operation.
+        capture: bool, optional
+            Whether to send the output to the logger when the process
+            finishes instead of writing it to stdout.
+        stream: bool, optional
+            Whether to send the output to the logger line by line as it is
+            written instead of writing it to stdout.
+        group: string, optional
+            The group of the process for fair scheduling, like an app dir.
+        priority: int, optional
+            The priority class of the process.
         """
         if not isinstance(cmd, (list, tuple)):
             raise ValueError('Command must be given as a list')
@@ -68,9 +387,38 @@ class Process(object):
         self.logger.info('> ' + list2cmdline(cmd))
         self.cmd = cmd
 
-        self.proc = self._create_process(cwd=cwd, env=env)
+        self._ticket = Scheduler.instance().acquire(
+            cmd, group=group, priority=priority, logger=logger,
+            kill_event=kill_event
+        )
+
+        self._output = tempfile.TemporaryFile() if capture else None
+        self._stream = stream and not capture
+        self.stats = None
+        self._cwd = cwd
+        self._start_time = time.time()
+        try:
+            self.proc = self._create_process(cwd=cwd, env=env)
+        except Exception:
+            self._release()
+            raise
         self._kill_event = kill_event or threading.Event()
 
+        self._stream_thread = None
+        if self._stream:
+            self._stdout = self.proc.stdout
+            self._stream_thread = threading.Thread(target=self._read_incoming)
+            self._stream_thread.daemon = True
+            self._stream_thread.start()
+
+        # Wait for the exit in a thread so waiters are notified at once.
+        self._exited = threading.Event()
+        self._exit_callbacks = []
+        self._exit_lock = threading.Lock()
+        thread = threading.Thread(target=self._wait_exit)
+        thread.daemon = True
+        thread.start()
+
         Process._procs.add(self)
 
     def terminate(self):
@@ -79,19 +427,20 @@ class Process(object):
         proc = self.proc
 
         # Kill the process.
-        if proc.poll() is None:
+        if not self._exited.is_set():
             try:
                 os.kill(proc.pid, signal.SIGTERM)
             except Exception as e:
                 self.logger.error(str(e))
 
-        # Wait for the process to close.
+        # Wait for the process to close, it is reaped by the wait thread.
         try:
-            proc.wait()
+            self._exited.wait()
         except Exception as e:
             self.logger.error(e)
         finally:
-            Process._procs.remove(self)
+            Process._procs.discard(self)
+            self._log_output()
 
         return proc.returncode
 
@@ -101,14 +450,12 @@ class Process(object):
         -------
         The process exit code.
         """
-        proc = self.proc
         kill_event = self._kill_event
         try:
-            while proc.poll() is None:
+            while not self._exited.wait(KILL_CHECK_INTERVAL):
                 if kill_event.is_set():
                     self.terminate()
                     raise ValueError('Process Aborted')
-                time.sleep(1.)
         except subprocess.CalledProcessError as error:
             output = error.output.decode('utf-8')
             self.logger.error(output)
@@ -121,14 +468,22 @@ class Process(object):
     def wait_async(self):
         """Asynchronously wait for the process to finish.
         """
-        proc = self.proc
         kill_event = self._kill_event
+        loop = IOLoop.current()
+        exited = Future()
+        self._add_exit_callback(
+            lambda: loop.add_callback(exited.set_result, None)
+        )
+        interval = timedelta(seconds=KILL_CHECK_INTERVAL)
         try:
-            while proc.poll() is None:
+            while not exited.done():
                 if kill_event.is_set():
                     self.terminate()
                     raise ValueError('Process Aborted')
-                yield gen.sleep(1.)
+                try:
+                    yield gen.with_timeout(interval, exited)
+                except gen.TimeoutError:
+                    pass
         except subprocess.CalledProcessError as error:
             output = error.output.decode('utf-8')
             self.logger.error(output)
@@ -137,11 +492,55 @@ class Process(object):
 
         raise gen.Return(self.terminate())
 
+    def _wait_exit(self):
+        """Wait for the process to exit and run the exit callbacks.
+        """
+        usage = None
+        try:
+            usage = _wait_child(self.proc)
+            # Log all of the output before the waiters are notified.
+            if self._stream_thread:
+                self._stream_thread.join()
+                self._stdout.close()
+        except Exception as e:
+            self.logger.debug('Wait error %s', e)
+        finally:
+            self.stats = _get_stats(self.cmd, self._cwd, self.proc.returncode,
+                                    time.time() - self._start_time, usage)
+            self._release()
+            with self._exit_lock:
+                self._exited.set()
+                callbacks, self._exit_callbacks = self._exit_callbacks, []
+            for callback in callbacks:
+                callback()
+
+    def _release(self):
+        """Release the scheduler slot of the process.
+        """
+        ticket, self._ticket = self._ticket, None
+        if ticket is not None:
+            Scheduler.instance().release(ticket, self.stats)
+
+    def _add_exit_callback(self, callback):
+        """Call a function from the waiting thread when the process exits.
+
+        The function is called immediately if the process has exited.
+        """
+        with self._exit_lock:
+            if not self._exited.is_set():
+                self._exit_callbacks.append(callback)
+                return
+        callback()
+
     def _create_process(self, **kwargs):
         """Create the process.
         """
         cmd = self.cmd
         kwargs.setdefault('stderr', subprocess.STDOUT)
+        if self._output:
+            kwargs['stdout'] = self._output
+        elif self._stream:
+            kwargs['stdout'] = subprocess.PIPE
 
         if os.name == 'nt':
             kwargs['shell'] = True
@@ -157,6 +556,39 @@ class Process(object):
 
         return proc
 
+    def _read_incoming(self):
+        """Run in a thread to read stdout and log complete lines"""
+        fileno = self._stdout.fileno()
+        pending = b''
+        while 1:
+            try:
+                buf = os.read(fileno, READ_CHUNK_SIZE)
+            except OSError as e:
+                self.logger.debug('Read incoming error %s', e)
+                buf = b''
+
+            if not buf:
+                if pending:
+                    self.logger.info(_decode_line(pending))
+                return
+
+            lines, pending = _split_lines(pending + buf)
+            for line in lines:
+                self.logger.info(_decode_line(line))
+
+    def _log_output(self):
+        """Send the captured output to the logger.
+        """
+        output = self._output
+        if not output:
+            return
+        self._output = None
+
+        output.seek(0)
+        for line in output.read().decode('utf-8', 'replace').splitlines():
+            self.logger.info(line)
+        output.close()
+
     @classmethod
     def _cleanup(cls):
         """Clean up the started subprocesses at exit.
@@ -167,6 +599,9 @@ class Process(object):
 
 class WatchHelper(Process):
     """A process helper for a watch process.
+
+    Watch processes run until they are stopped, so they give back their
+    slot of the scheduler once started and keep their memory.
     """
 
     def __init__(self, cmd, startup_regex, logger=None, cwd=None,
@@ -197,10 +632,13 @@ class WatchHelper(Process):
             line = self._stdout.readline().decode('utf-8')
             if not line:
                 raise RuntimeError('Process ended improperly')
-            print(line.rstrip())
+            self.logger.info(line.rstrip())
             if re.match(startup_regex, line):
                 break
 
+        if self._ticket is not None:
+            Scheduler.instance().idle(self._ticket)
+
         self._read_thread = threading.Thread(target=self._read_incoming)
         self._read_thread.setDaemon(True)
         self._read_thread.start()
@@ -210,7 +648,7 @@ class WatchHelper(Process):
         """
         proc = self.proc
 
-        if proc.poll() is None:
+        if not self._exited.is_set():
             if os.name != 'nt':
                 # Kill the process group if we started a new session.
                 os.killpg(os.getpgid(proc.pid), signal.SIGTERM)
@@ -225,30 +663,15 @@ class WatchHelper(Process):
 
         # Wait for the process to close.
         try:
-            proc.wait()
+            self._exited.wait()
         except Exception as e:
             print('on close')
             self.logger.error(e)
         finally:
-            Process._procs.remove(self)
+            Process._procs.discard(self)
 
         return proc.returncode
 
-    def _read_incoming(self):
-        """Run in a thread to read stdout and print"""
-        fileno = self._stdout.fileno()
-        while 1:
-            try:
-                buf = os.read(fileno, 1024)
-            except OSError as e:
-                self.logger.debug('Read incoming error %s', e)
-                return
-
-            if not buf:
-                return
-
-            print(buf.decode('utf-8'), end='')
-
     def _create_process(self, **kwargs):
         """Create the watcher helper process.
         """
@@ -271,5 +694,591 @@ class WatchHelper(Process):
         return super(WatchHelper, self)._create_process(**kwargs)
 
 
-# Register the cleanup handler.
+class AsyncProcess(object):
+    """A child process that streams its output on the IOLoop.
+
+    The stdout and stderr of the process are read without blocking and
+    sent line by line to the logger and to the sinks.  A sink is called
+    with the stream name, 'stdout' or 'stderr', and the line, and may
+    return a future to hold further reads of the stream until it is done,
+    which blocks the process once the pipe is full.
+
+    The process starts in `wait_async` once the shared scheduler has a
+    slot for it.  It must be waited on the thread of the IOLoop and is not
+    supported on Windows.
+    """
+
+    def __init__(self, cmd, logger=None, cwd=None, kill_event=None,
+                 env=None, sinks=None, group=None, priority=PRIORITY_NORMAL):
+        """Create a subprocess with streamed output.
+        Parameters
+        ----------
+        cmd: list
+            The command to run.
+        logger: :class:`~logger.Logger`, optional
+            The logger instance.
+        cwd: string, optional
+            The cwd of the process.
+        env: dict, optional
+            The environment for the process.
+        kill_event: :class:`~threading.Event`, optional
+            An event used to kill the process operation.
+        sinks: list, optional
+            The callables that receive the output lines.
+        group: string, optional
+            The group of the process for fair scheduling, like an app dir.
+        priority: int, optional
+            The priority class of the process.
+        """
+        if not isinstance(cmd, (list, tuple)):
+            raise ValueError('Command must be given as a list')
+
+        if kill_event and kill_event.is_set():
+            raise ValueError('Process aborted')
+
+        self.logger = logger or logging.getLogger('quantlab')
+        self.logger.info('> ' + list2cmdline(cmd))
+        self.cmd = cmd
+        self.sinks = list(sinks or [])
+        self.stats = None
+        self.proc = None
+        self._cwd = cwd
+        self._env = env
+        self._group = group
+        self._priority = priority
+        self._start_time = None
+        self._kill_event = kill_event or threading.Event()
+        self._terminated = False
+
+    def terminate(self):
+        """Terminate the process and return the exit code, if known.
+
+        The process is reaped by the IOLoop, so this does not wait.
+        """
+        self._terminated = True
+        if self.proc is None:
+            return None
+        proc = self.proc.proc
+        if proc.returncode is None:
+            try:
+                os.kill(proc.pid, signal.SIGTERM)
+            except Exception as e:
+                self.logger.error(str(e))
+        Process._procs.discard(self)
+        return proc.returncode
+
+    @gen.coroutine
+    def wait_async(self):
+        """Asynchronously wait for the process to finish.
+
+        Returns the exit code once all of the output is streamed.
+        """
+        kill_event = self._kill_event
+        scheduler = Scheduler.instance()
+        ticket = yield scheduler.acquire_async(
+            self.cmd, group=self._group, priority=self._priority,
+            logger=self.logger, kill_event=kill_event
+        )
+        try:
+            if self._terminated:
+                raise ValueError('Process Aborted')
+            cmd = list(self.cmd)
+            cmd[0] = which(cmd[0], self._env)
+            self._start_time = time.time()
+            self.proc = Subprocess(cmd, stdout=Subprocess.STREAM,
+                                   stderr=Subprocess.STREAM, cwd=self._cwd,
+                                   env=self._env)
+            Process._procs.add(self)
+
+            # The output ends when the process exits, then the process is
+            # reaped here instead of by the IOLoop to get its resource
+            # usage.
+            proc = self.proc.proc
+            readers = gen.multi([
+                self._read_stream(self.proc.stdout, 'stdout'),
+                self._read_stream(self.proc.stderr, 'stderr')
+            ])
+            interval = timedelta(seconds=KILL_CHECK_INTERVAL)
+            usage = None
+            while proc.returncode is None:
+                if kill_event.is_set():
+                    self.terminate()
+                    raise ValueError('Process Aborted')
+                if not readers.done():
+                    try:
+                        yield gen.with_timeout(interval, readers)
+                    except gen.TimeoutError:
+                        pass
+                    continue
+                usage = _wait_child(proc, block=False)
+                if proc.returncode is None:
+                    yield gen.sleep(KILL_CHECK_INTERVAL)
+            yield readers
+
+            self.stats = _get_stats(self.cmd, self._cwd, proc.returncode,
+                                    time.time() - self._start_time, usage)
+        finally:
+            scheduler.release(ticket, self.stats)
+        Process._procs.discard(self)
+        raise gen.Return(proc.returncode)
+
+    @gen.coroutine
+    def _read_stream(self, stream, name):
+        """Read a stream and send its lines to the logger and sinks.
+        """
+        pending = b''
+        while True:
+            try:
+                chunk = yield stream.read_bytes(READ_CHUNK_SIZE, partial=True)
+            except StreamClosedError:
+                break
+            lines, pending = _split_lines(pending + chunk)
+            for line in lines:
+                yield self._emit(name, _decode_line(line))
+        if pending:
+            yield self._emit(name, _decode_line(pending))
+
+    @gen.coroutine
+    def _emit(self, name, line):
+        """Send a line to the logger and the sinks.
+        """
+        self.logger.info(line)
+        for sink in self.sinks:
+            result = sink(name, line)
+            if is_future(result):
+                yield result
+
+
+class NodeWorker(object):
+    """A persistent Node process that runs Node scripts.
+
+    Commands like `node yarn.js install` or `npm pack` run in worker
+    threads of the Node process, which saves the startup of Node and the
+    compilation of the script for every command.  The process is started
+    on demand, restarted when it dies or does not answer a health check,
+    and exits on its own when it is idle.
+
+    The shared worker is opt-in with the QUANTLAB_NODE_WORKER environment
+    variable, and QUANTLAB_NODE_WORKER_IDLE sets its idle timeout in
+    seconds.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, logger=None, idle_timeout=300):
+        self.logger = logger or logging.getLogger('quantlab')
+        self.idle_timeout = idle_timeout
+        self._proc = None
+        self._tasks = dict()
+        self._pings = dict()
+        self._ids = itertools.count(1)
+        self._last_seen = 0
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        """Get the shared worker, or `None` if it is not enabled.
+        """
+        if not os.environ.get('QUANTLAB_NODE_WORKER'):
+            return None
+        with cls._instance_lock:
+            if cls._instance is None:
+                idle = os.environ.get('QUANTLAB_NODE_WORKER_IDLE', '300')
+                cls._instance = cls(idle_timeout=float(idle))
+            return cls._instance
+
+    def run(self, cmd, cwd=None, env=None, logger=None, kill_event=None,
+            group=None, priority=PRIORITY_NORMAL):
+        """Run a command in the worker.
+
+        The command takes a slot of the shared scheduler while it runs.
+        Returns the stats record of the command, or `None` if the command
+        does not run a Node script or the worker is not available, in
+        which case the command should be run in a subprocess.  Raises a
+        `RuntimeError` if the worker exits while running the command, since
+        the command may have made changes that running it again would not
+        expect.
+        """
+        script = _get_node_script(cmd)
+        if script is None:
+            return None
+        if kill_event and kill_event.is_set():
+            raise ValueError('Process aborted')
+        if not self._ensure_started():
+            return None
+
+        logger = logger or self.logger
+        logger.info('> ' + list2cmdline(cmd))
+        scheduler = Scheduler.instance()
+        ticket = scheduler.acquire(cmd, group=group, priority=priority,
+                                   logger=logger, kill_event=kill_event)
+        try:
+            return self._run_task(cmd, script, cwd, env, logger, kill_event)
+        finally:
+            scheduler.release(ticket)
+
+    def _run_task(self, cmd, script, cwd, env, logger, kill_event):
+        """Run the script of a command in the worker.
+        """
+        cwd = osp.abspath(cwd or os.getcwd())
+        task = dict(logger=logger, done=threading.Event(), code=None,
+                    pending=b'')
+        start_time = time.time()
+        with self._lock:
+            task_id = next(self._ids)
+            self._tasks[task_id] = task
+            sent = self._send(dict(
+                id=task_id, type='run', script=script[0], args=script[1],
+                cwd=cwd, env=dict(env or os.environ)
+            ))
+        if not sent:
+            with self._lock:
+                self._tasks.pop(task_id, None)
+            return None
+
+        while not task['done'].wait(KILL_CHECK_INTERVAL):
+            if kill_event and kill_event.is_set():
+                with self._lock:
+                    proc = self._proc
+                    self._send(dict(id=task_id, type='cancel'))
+                if not task['done'].wait(WORKER_CANCEL_TIMEOUT):
+                    self.logger.debug('Restarting the Node worker that did '
+                                      'not cancel a task')
+                    self._restart(proc)
+                raise ValueError('Process Aborted')
+
+        if task['code'] is None:
+            raise RuntimeError('The Node worker exited while running %s'
+                               % list2cmdline(cmd))
+        return _get_stats(cmd, cwd, task['code'], time.time() - start_time,
+                          None)
+
+    def ping(self, timeout=WORKER_PING_TIMEOUT):
+        """Test whether the worker answers within a timeout.
+        """
+        event = threading.Event()
+        with self._lock:
+            ping_id = next(self._ids)
+            self._pings[ping_id] = event
+            sent = self._send(dict(id=ping_id, type='ping'))
+        try:
+            return sent and event.wait(timeout)
+        finally:
+            with self._lock:
+                self._pings.pop(ping_id, None)
+
+    def shutdown(self):
+        """Stop the worker process.
+        """
+        with self._start_lock:
+            proc = self._proc
+            if proc is not None:
+                self._stop(proc)
+
+    def _ensure_started(self):
+        """Start or restart the worker process as needed.
+
+        Returns whether the worker is running.
+        """
+        with self._start_lock:
+            proc = self._proc
+            if proc is not None and proc.poll() is None:
+                idle = time.time() - self._last_seen
+                if idle < WORKER_CHECK_INTERVAL or self.ping():
+                    return True
+                self.logger.debug('Restarting the unresponsive Node worker')
+                self._stop(proc)
+
+            try:
+                proc = subprocess.Popen(
+                    [which('node'), WORKER_PATH, str(self.idle_timeout)],
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT
+                )
+            except (OSError, ValueError) as e:
+                self.logger.debug('Could not start the Node worker: %s', e)
+                return False
+
+            with self._lock:
+                self._proc = proc
+            thread = threading.Thread(target=self._read, args=(proc,))
+            thread.daemon = True
+            thread.start()
+            if self.ping():
+                return True
+            self._stop(proc)
+            return False
+
+    def _restart(self, proc):
+        """Stop a worker process if it is current, to start a new one.
+        """
+        with self._start_lock:
+            if proc is not None and proc is self._proc:
+                self._stop(proc)
+
+    def _stop(self, proc):
+        """Stop a worker process and wait for it.
+
+        The worker stops the children of its tasks on SIGTERM, and is
+        killed if it does not exit in time.
+        """
+        try:
+            proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        try:
+            proc.terminate()
+        except OSError:
+            pass
+        deadline = time.time() + WORKER_STOP_TIMEOUT
+        while proc.poll() is None and time.time() < deadline:
+            time.sleep(0.1)
+        if proc.poll() is None:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+        proc.wait()
+
+    def _send(self, msg):
+        """Send a message to the worker, holding the lock.
+
+        Returns whether the message was sent.
+        """
+        proc = self._proc
+        if proc is None:
+            return False
+        try:
+            proc.stdin.write((json.dumps(msg) + '\n').encode('utf-8'))
+            proc.stdin.flush()
+        except (IOError, OSError, ValueError) as e:
+            self.logger.debug('Could not send to the Node worker: %s', e)
+            return False
+        return True
+
+    def _read(self, proc):
+        """Read the messages and output of a worker process in a thread.
+        """
+        for line in iter(proc.stdout.readline, b''):
+            self._last_seen = time.time()
+            text = _decode_line(line.rstrip(b'\n'))
+            if text.startswith(WORKER_MARKER):
+                self._handle(json.loads(text[len(WORKER_MARKER):]))
+                continue
+
+            # Output of the child processes of a task.
+            with self._lock:
+                tasks = list(self._tasks.values())
+            logger = tasks[0]['logger'] if len(tasks) == 1 else self.logger
+            logger.info(text)
+
+        # The worker exited, end its unfinished tasks.
+        with self._lock:
+            if self._proc is proc:
+                self._proc = None
+                tasks = list(self._tasks.values())
+                self._tasks.clear()
+            else:
+                tasks = []
+        for task in tasks:
+            task['done'].set()
+
+    def _handle(self, msg):
+        """Handle a message from the worker.
+        """
+        with self._lock:
+            if msg['type'] == 'pong':
+                event = self._pings.get(msg['id'])
+                if event:
+                    event.set()
+                return
+            task = self._tasks.get(msg['id'])
+            if task is None:
+                return
+            if msg['type'] == 'exit':
+                del self._tasks[msg['id']]
+
+        logger = task['logger']
+        if msg['type'] == 'output':
+            data = task['pending'] + msg['data'].encode('utf-8')
+            lines, task['pending'] = _split_lines(data)
+            for line in lines:
+                logger.info(_decode_line(line))
+        elif msg['type'] == 'exit':
+            if task['pending']:
+                logger.info(_decode_line(task['pending']))
+            task['code'] = msg['code']
+            task['done'].set()
+
+    @classmethod
+    def _cleanup(cls):
+        """Stop the shared worker at exit.
+        """
+        if cls._instance is not None:
+            cls._instance.shutdown()
+
+
+def format_stats(records):
+    """Format process stats records as a table.
+    """
+    def seconds(value):
+        return '-' if value is None else '%.1f' % value
+
+    rows = [('Command', 'Exit', 'Wall (s)', 'CPU (s)', 'Peak RSS (MB)')]
+    for record in records:
+        cmd = record['cmd']
+        if len(cmd) > 50:
+            cmd = cmd[:47] + '...'
+        max_rss = record['max_rss']
+        rows.append((
+            cmd, str(record['returncode']), seconds(record['wall_time']),
+            seconds(record['cpu_time']),
+            '-' if max_rss is None else '%.0f' % (max_rss / 1e6)
+        ))
+
+    cpu_times = [r['cpu_time'] for r in records if r['cpu_time'] is not None]
+    rows.append((
+        'Total', '', seconds(sum(r['wall_time'] for r in records)),
+        seconds(sum(cpu_times)) if cpu_times else '-', ''
+    ))
+
+    widths = [max(len(row[i]) for row in rows) for i in range(5)]
+    lines = []
+    for row in rows:
+        cells = [row[0].ljust(widths[0])]
+        cells += [cell.rjust(width)
+                  for (cell, width) in zip(row[1:], widths[1:])]
+        lines.append('  '.join(cells).rstrip())
+    return '\n'.join(lines)
+
+
+def _get_process_slots():
+    """Get the number of processes the shared scheduler runs at once.
+    """
+    slots = os.environ.get('QUANTLAB_PROCESS_SLOTS')
+    if slots:
+        return max(int(slots), 1)
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def _get_process_memory():
+    """Get the memory budget in bytes of the shared scheduler.
+
+    Returns 0 if there is no limit.
+    """
+    memory = os.environ.get('QUANTLAB_PROCESS_MEMORY')
+    if memory:
+        return int(memory) * 1024 * 1024
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+
+def _get_command_key(cmd):
+    """Get the key of a command for its memory estimate.
+
+    Commands that run the same program or Node script with the same
+    subcommand share a key.
+    """
+    names = [osp.basename(part) for part in cmd[:2]]
+    if len(cmd) > 1 and names[0].lower() in ['node', 'node.exe']:
+        names = names[1:] + list(cmd[2:4])
+    else:
+        names = names[:1] + list(cmd[1:2])
+    return ' '.join(arg for arg in names if not arg.startswith('-'))
+
+
+def _get_node_script(cmd):
+    """Get the script and arguments of a command that runs a Node script.
+
+    Returns `None` for other commands.
+    """
+    if osp.basename(cmd[0]).lower() in ['node', 'node.exe']:
+        if len(cmd) < 2 or not cmd[1].endswith('.js'):
+            return None
+        return osp.abspath(cmd[1]), list(cmd[2:])
+
+    # Commands like npm are links to a Node script.
+    path = osp.realpath(cmd[0])
+    if path.endswith('.js') and osp.isfile(path):
+        return path, list(cmd[1:])
+    return None
+
+
+def _wait_child(proc, block=True):
+    """Wait for a child process and set its exit code.
+
+    Returns the resource usage of the child and its descendants, or `None`
+    if it is not available.  Without `block`, returns at once and leaves
+    the exit code unset if the child is running.
+    """
+    if not hasattr(os, 'wait4'):
+        if block:
+            proc.wait()
+        else:
+            proc.poll()
+        return None
+    try:
+        (pid, status, usage) = os.wait4(proc.pid, 0 if block else os.WNOHANG)
+    except OSError:
+        # The process was already reaped.
+        proc.wait()
+        return None
+    if pid == 0:
+        return None
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return usage
+
+
+def _get_stats(cmd, cwd, returncode, wall_time, usage):
+    """Get the stats record of a finished process.
+
+    The peak RSS is the largest of the process and its descendants.
+    """
+    stats = dict(cmd=list2cmdline(cmd), cwd=cwd, returncode=returncode,
+                 wall_time=wall_time, user_time=None, system_time=None,
+                 cpu_time=None, max_rss=None)
+    if usage is not None:
+        stats.update(user_time=usage.ru_utime, system_time=usage.ru_stime,
+                     cpu_time=usage.ru_utime + usage.ru_stime,
+                     max_rss=usage.ru_maxrss * MAXRSS_UNIT)
+    return stats
+
+
+def _split_lines(data):
+    """Split output into complete lines and the pending remainder.
+
+    Splits the remainder when it grows over the maximum line length.
+    """
+    lines = data.split(b'\n')
+    pending = lines.pop()
+    while len(pending) > MAX_LINE_LENGTH:
+        lines.append(pending[:MAX_LINE_LENGTH])
+        pending = pending[MAX_LINE_LENGTH:]
+    return lines, pending
+
+
+def _decode_line(line):
+    """Decode a line of output.
+    """
+    return line.decode('utf-8', 'replace').rstrip('\r')
+
+
+def _set_future_result(future, result):
+    """Set the result of a future unless it is done.
+    """
+    if not future.done():
+        future.set_result(result)
+
+
+# Register the cleanup handlers.
 atexit.register(Process._cleanup)
+atexit.register(NodeWorker._cleanup)
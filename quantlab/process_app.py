@@ -9,7 +9,7 @@ import shutil
 import sys
 import tempfile
 
-from quantlab.process import Process
+from quantlab.process import AsyncProcess, Process
 from notebook.notebookapp import NotebookApp
 from tornado.ioloop import IOLoop
 from traitlets import Bool, Unicode
@@ -35,7 +35,8 @@ class ProcessApp(NotebookApp):
     def _run_command(self):
         command, kwargs = self.get_command()
         kwargs.setdefault('logger', self.log)
-        future = Process(command, **kwargs).wait_async()
+        cls = Process if os.name == 'nt' else AsyncProcess
+        future = cls(command, **kwargs).wait_async()
         IOLoop.current().add_future(future, self._process_finished)
 
     def _process_finished(self, future):
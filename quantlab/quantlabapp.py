@@ -5,7 +5,7 @@
 # Distributed under the terms of the Modified BSD License.
 
 from notebook.notebookapp import NotebookApp, aliases, flags
-from jupyter_core.application import JupyterApp, base_aliases
+from jupyter_core.application import JupyterApp, base_aliases, base_flags
 
 from traitlets import Bool, Unicode
 
@@ -15,6 +15,7 @@ from .commands import (
     build, clean, get_app_dir, get_user_settings_dir, get_app_version,
     ensure_dev
 )
+from .process import format_stats
 
 
 build_aliases = dict(base_aliases)
@@ -22,6 +23,12 @@ build_aliases['app-dir'] = 'QuantLabBuildApp.app_dir'
 build_aliases['name'] = 'QuantLabBuildApp.name'
 build_aliases['version'] = 'QuantLabBuildApp.version'
 
+build_flags = dict(base_flags)
+build_flags['force-install'] = (
+    {'QuantLabBuildApp': {'force_install': True}},
+    "Run yarn install even if the installed packages are up to date."
+)
+
 
 version = __version__
 app_version = get_app_version()
@@ -38,6 +45,7 @@ class QuantLabBuildApp(JupyterApp):
     directory, where it is used to serve the application.
     """
     aliases = build_aliases
+    flags = build_flags
 
     app_dir = Unicode('', config=True,
         help="The app directory to build in")
@@ -48,8 +56,14 @@ class QuantLabBuildApp(JupyterApp):
     version = Unicode('', config=True,
         help="The version of the built application")
 
+    force_install = Bool(False, config=True,
+        help="Whether to run yarn install even if it is up to date")
+
     def start(self):
-        build(self.app_dir, self.name, self.version)
+        stats = build(self.app_dir, self.name, self.version,
+                      force_install=self.force_install)
+        if stats:
+            self.log.info('Build summary:\n' + format_stats(stats))
 
 
 clean_aliases = dict(base_aliases)
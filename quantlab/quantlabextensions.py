@@ -14,7 +14,7 @@ from jupyter_core.application import JupyterApp, base_flags, base_aliases
 from traitlets import Bool, Unicode
 
 from .commands import (
-    install_extension, uninstall_extension, list_extensions,
+    install_extensions, uninstall_extensions, list_extensions,
     enable_extension, disable_extension,
     link_package, unlink_package, build, get_app_version
 )
@@ -75,8 +75,7 @@ class InstallQuantLabExtensionApp(BaseExtensionApp):
 
     def run_task(self):
         self.extra_args = self.extra_args or [os.getcwd()]
-        [install_extension(arg, self.app_dir, logger=self.log) for
-         arg in self.extra_args]
+        install_extensions(self.extra_args, self.app_dir, logger=self.log)
 
         if self.should_build:
             build(self.app_dir, clean_staging=self.should_clean,
@@ -124,8 +123,8 @@ class UninstallQuantLabExtensionApp(BaseExtensionApp):
 
     def run_task(self):
         self.extra_args = self.extra_args or [os.getcwd()]
-        ans = any([uninstall_extension(arg, self.app_dir, logger=self.log)
-                   for arg in self.extra_args])
+        ans = uninstall_extensions(self.extra_args, self.app_dir,
+                                   logger=self.log)
         if ans and self.should_build:
             build(self.app_dir, clean_staging=self.should_clean,
                   logger=self.log)
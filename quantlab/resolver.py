@@ -0,0 +1,196 @@
+# coding: utf-8
+"""An offline check of a staging directory against its yarn.lock file.
+
+The dependencies of the staging `package.json` and of the package tarballs
+it references are followed through the lock file the way `yarn install`
+would look them up.  The check predicts whether the lock file still
+satisfies every range, in which case a frozen install can be used, and
+which dependencies would need to be resolved again.  It also reports the
+singleton packages that are requested with ranges no single version can
+satisfy.
+"""
+
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+from __future__ import print_function
+
+import io
+import json
+import os.path as osp
+import re
+import tarfile
+
+from .semver import intersects, satisfies, valid_range
+
+
+# The dependency fields that are installed.
+DEPENDENCY_FIELDS = ['dependencies', 'devDependencies', 'optionalDependencies']
+
+# A quoted or a bare token of a lock file line.
+_TOKEN = re.compile(r'"((?:[^"\\]|\\.)*)"|([^\s,"]+)')
+
+
+def parse_lockfile(text):
+    """Parse the text of a yarn lock file (v1).
+
+    Returns a dictionary of the entries by their `name@range` keys, where
+    entries listed under several keys are shared.
+    """
+    entries = dict()
+    stack = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        indent = len(line) - len(line.lstrip())
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+
+        if stripped.endswith(':'):
+            keys = _tokens(stripped[:-1])
+            value = dict()
+            if stack:
+                stack[-1][1][keys[0]] = value
+            else:
+                for key in keys:
+                    entries[key] = value
+            stack.append((indent, value))
+        elif stack:
+            tokens = _tokens(stripped)
+            stack[-1][1][tokens[0]] = ' '.join(tokens[1:])
+    return entries
+
+
+def read_lockfile(path):
+    """Read a yarn lock file, or return `None` if it does not exist.
+    """
+    if not osp.exists(path):
+        return None
+    with io.open(path, encoding='utf-8') as fid:
+        return parse_lockfile(fid.read())
+
+
+def check_lockfile(staging, singletons=(), read_tarball=None):
+    """Check the dependencies of a staging directory against its lock file.
+
+    Parameters
+    ----------
+    staging: str
+        The directory with the `package.json` and `yarn.lock` files.
+    singletons: list, optional
+        The names of the packages that must resolve to a single version.
+    read_tarball: callable, optional
+        A function that returns the package data of a tarball path, like
+        a lookup in an index, used instead of opening the tarball.
+
+    Returns
+    -------
+    A dictionary with `satisfied`, whether the lock file satisfies every
+    dependency, `unresolved`, the sorted `name@range` keys that would be
+    resolved again, and `conflicts`, the (name, range, range) tuples of
+    singleton ranges without a common version.
+    """
+    lock = read_lockfile(osp.join(staging, 'yarn.lock'))
+    with io.open(osp.join(staging, 'package.json'), encoding='utf-8') as fid:
+        data = json.load(fid)
+
+    unresolved = set()
+    requested = dict((name, []) for name in singletons)
+    seen = set()
+    queue = list(_get_dependencies(data, DEPENDENCY_FIELDS))
+
+    while queue:
+        (name, spec) = queue.pop()
+        key = '%s@%s' % (name, spec)
+        if key in seen:
+            continue
+        seen.add(key)
+
+        is_range = valid_range(spec, False) is not None
+        if is_range and name in requested and spec not in requested[name]:
+            requested[name].append(spec)
+
+        entry = lock.get(key) if lock else None
+        package = None
+        if spec.startswith('file:'):
+            package = _read_package(osp.join(staging, spec[len('file:'):]),
+                                    read_tarball)
+
+        if package is not None:
+            # The package contents take precedence over its lock entry.
+            deps = dict(_get_dependencies(package, ['dependencies',
+                                                    'optionalDependencies']))
+            if (entry is None or
+                    entry.get('version') != package.get('version') or
+                    deps != _get_entry_dependencies(entry)):
+                unresolved.add(key)
+            queue.extend(deps.items())
+            continue
+
+        if entry is None:
+            unresolved.add(key)
+            continue
+        if is_range and not satisfies(entry.get('version', ''), spec, True):
+            unresolved.add(key)
+        queue.extend(_get_entry_dependencies(entry).items())
+
+    conflicts = []
+    for name in sorted(requested):
+        specs = sorted(requested[name])
+        for (i, spec1) in enumerate(specs):
+            for spec2 in specs[i + 1:]:
+                if not intersects(spec1, spec2, True):
+                    conflicts.append((name, spec1, spec2))
+
+    return dict(
+        satisfied=lock is not None and not unresolved,
+        unresolved=sorted(unresolved),
+        conflicts=conflicts
+    )
+
+
+def _tokens(text):
+    """Get the unquoted tokens of a lock file line.
+    """
+    tokens = []
+    for match in _TOKEN.finditer(text):
+        if match.group(1) is not None:
+            tokens.append(json.loads('"%s"' % match.group(1)))
+        else:
+            tokens.append(match.group(2))
+    return tokens
+
+
+def _get_dependencies(data, fields):
+    """Get the (name, spec) pairs of the dependency fields of a package.
+    """
+    for field in fields:
+        for item in (data.get(field) or dict()).items():
+            yield item
+
+
+def _get_entry_dependencies(entry):
+    """Get the dependencies of a lock file entry by name.
+    """
+    deps = dict(entry.get('dependencies', dict()))
+    deps.update(entry.get('optionalDependencies', dict()))
+    return deps
+
+
+def _read_package(path, read_tarball=None):
+    """Read the package data of a package tarball or directory.
+
+    Returns `None` if the package cannot be read.
+    """
+    try:
+        if osp.isdir(path):
+            with io.open(osp.join(path, 'package.json'),
+                         encoding='utf-8') as fid:
+                return json.load(fid)
+        if read_tarball is not None:
+            return read_tarball(path)
+        with tarfile.open(path, 'r:gz') as tar:
+            fid = tar.extractfile('package/package.json')
+            return json.loads(fid.read().decode('utf-8'))
+    except (IOError, OSError, KeyError, ValueError, tarfile.TarError):
+        return None
@@ -28,7 +28,11 @@
 # -*- coding:utf-8 -*-
 import logging
 logger = logging.getLogger(__name__)
+import copy
 import re
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
 
 SEMVER_SPEC_VERSION = '2.0.0'
 
@@ -37,6 +41,43 @@ try:
 except NameError:
     string_type = str # Python 3
 
+class _LRUCache(object):
+    """A bounded cache that evicts its least recently used items.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        """Get the value for a key, creating it with `factory(*key)`.
+        """
+        with self._lock:
+            if key in self._data:
+                value = self._data.pop(key)
+                self._data[key] = value
+                return value
+
+        value = factory(*key)
+        with self._lock:
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+#  Parsed objects are shared through these caches, so they must not be
+#  mutated.  Use `copy.copy` to get a private SemVer.
+_semver_cache = _LRUCache(4096)
+_comparator_cache = _LRUCache()
+_range_cache = _LRUCache()
+
+
 class _R(object):
     def __init__(self, i):
         self.i = i
@@ -322,11 +363,16 @@ def semver(version, loose):
     if (!(this instanceof SemVer))
        return new SemVer(version, loose);
     """
-    return SemVer(version, loose)
+    return _semver_cache.get((version, loose), SemVer)
 make_semver = semver
 
 
 class SemVer(object):
+    #  Parsed versions are shared through `_semver_cache`, so they keep
+    #  their identifiers in tuples and `inc` returns a new version.
+    __slots__ = ('loose', 'raw', 'major', 'minor', 'patch', 'prerelease',
+                 'build', 'version', 'key')
+
     def __init__(self, version, loose):
         logger.debug("SemVer %s, %s", version, loose)
         self.loose = loose
@@ -341,10 +387,12 @@ class SemVer(object):
             self.minor = int(m.group(2)) if m.group(2) else 0
             self.patch = 0
             if not m.group(3):
-                self.prerelease = []
+                self.prerelease = ()
             else:
-                self.prerelease = [(int(id) if NUMERIC.search(id) else id)
-                                   for id in m.group(3).split(".")]
+                self.prerelease = tuple(
+                    (int(id) if NUMERIC.search(id) else id)
+                    for id in m.group(3).split("."))
+            self.build = ()
         else:
             #  these are actually numbers
             self.major = int(m.group(1))
@@ -352,22 +400,30 @@ class SemVer(object):
             self.patch = int(m.group(3))
             #  numberify any prerelease numeric ids
             if not m.group(4):
-                self.prerelease = []
+                self.prerelease = ()
             else:
-
-                self.prerelease = [(int(id) if NUMERIC.search(id) else id)
-                                   for id in m.group(4).split(".")]
+                self.prerelease = tuple(
+                    (int(id) if NUMERIC.search(id) else id)
+                    for id in m.group(4).split("."))
             if m.group(5):
-                self.build = m.group(5).split(".")
+                self.build = tuple(m.group(5).split("."))
             else:
-                self.build = []
+                self.build = ()
 
         self.format()  # xxx:
 
+    def __copy__(self):
+        other = SemVer.__new__(SemVer)
+        for name in SemVer.__slots__:
+            setattr(other, name, getattr(self, name))
+        other.prerelease = list(self.prerelease)
+        return other
+
     def format(self):
         self.version = "{}.{}.{}".format(self.major, self.minor, self.patch)
         if len(self.prerelease) > 0:
             self.version += ("-{}".format(".".join(str(v) for v in self.prerelease)))
+        self.key = version_key(self)
         return self.version
 
     def __repr__(self):
@@ -380,57 +436,28 @@ class SemVer(object):
         logger.debug('SemVer.compare %s %s %s', self.version, self.loose, other)
         if not isinstance(other, SemVer):
             other = make_semver(other, self.loose)
-        result = self.compare_main(other) or self.compare_pre(other)
-        logger.debug("compare result %s", result)
-        return result
+        return _compare_keys(self.key, other.key)
 
     def compare_main(self, other):
         if not isinstance(other, SemVer):
             other = make_semver(other, self.loose)
-
-        return (compare_identifiers(str(self.major), str(other.major)) or
-                compare_identifiers(str(self.minor), str(other.minor)) or
-                compare_identifiers(str(self.patch), str(other.patch)))
+        return _compare_keys(self.key[:3], other.key[:3])
 
     def compare_pre(self, other):
         if not isinstance(other, SemVer):
             other = make_semver(other, self.loose)
-
-        #  NOT having a prerelease is > having one
-        is_self_more_than_zero = len(self.prerelease) > 0
-        is_other_more_than_zero = len(other.prerelease) > 0
-
-        if not is_self_more_than_zero and is_other_more_than_zero:
-            return 1
-        elif is_self_more_than_zero and not is_other_more_than_zero:
-            return -1
-        elif not is_self_more_than_zero and not is_other_more_than_zero:
-            return 0
-
-        i = 0
-        while True:
-            a = list_get(self.prerelease, i)
-            b = list_get(other.prerelease, i)
-            logger.debug("prerelease compare %s: %s %s", i, a, b)
-            i += 1
-            if a is None and b is None:
-                return 0
-            elif b is None:
-                return 1
-            elif a is None:
-                return -1
-            elif a == b:
-                continue
-            else:
-                return compare_identifiers(str(a), str(b))
+        #  NOT having a prerelease is > having one, see `version_key`.
+        return _compare_keys(self.key[3], other.key[3])
 
     def inc(self, release):
-        self._inc(release)
+        other = copy.copy(self)
+        other._inc(release)
         i = -1
-        while len(self.prerelease) > 1 and self.prerelease[i] == 0:
-            self.prerelease.pop()
-        self.format()
-        return self
+        while len(other.prerelease) > 1 and other.prerelease[i] == 0:
+            other.prerelease.pop()
+        other.prerelease = tuple(other.prerelease)
+        other.format()
+        return other
 
     def _inc(self, release):
         logger.debug("inc release %s %s", self.prerelease, release)
@@ -517,6 +544,10 @@ def rcompare_identifiers(a, b):
     return compare_identifiers(b, a)
 
 
+def _compare_keys(a, b):
+    return (a > b) - (a < b)
+
+
 def compare(a, b, loose):
     return make_semver(a, loose).compare(b)
 
@@ -529,38 +560,44 @@ def rcompare(a, b, loose):
     return compare(b, a, loose)
 
 
+def sort_key(version, loose):
+    """Get the key of a version for sorting, see `version_key`.
+    """
+    return make_semver(version, loose).key
+
+
 def sort(list, loose):
-    list.sort(lambda a, b: compare(a, b, loose))
+    list.sort(key=lambda v: sort_key(v, loose))
     return list
 
 
 def rsort(list, loose):
-    list.sort(lambda a, b: rcompare(a, b, loose))
+    list.sort(key=lambda v: sort_key(v, loose), reverse=True)
     return list
 
 
 def gt(a, b, loose):
-    return compare(a, b, loose) > 0
+    return sort_key(a, loose) > sort_key(b, loose)
 
 
 def lt(a, b, loose):
-    return compare(a, b, loose) < 0
+    return sort_key(a, loose) < sort_key(b, loose)
 
 
 def eq(a, b, loose):
-    return compare(a, b, loose) == 0
+    return sort_key(a, loose) == sort_key(b, loose)
 
 
 def neq(a, b, loose):
-    return compare(a, b, loose) != 0
+    return sort_key(a, loose) != sort_key(b, loose)
 
 
 def gte(a, b, loose):
-    return compare(a, b, loose) >= 0
+    return sort_key(a, loose) >= sort_key(b, loose)
 
 
 def lte(a, b, loose):
-    return compare(a, b, loose) <= 0
+    return sort_key(a, loose) <= sort_key(b, loose)
 
 
 def cmp(a, op, b, loose):
@@ -594,7 +631,7 @@ def comparator(comp, loose):
 
     # if (!(this instanceof Comparator))
     #   return new Comparator(comp, loose)
-    return Comparator(comp, loose)
+    return _comparator_cache.get((comp, loose), Comparator)
 make_comparator = comparator
 
 ANY = object()
@@ -638,6 +675,7 @@ class Comparator(object):
             #  The assumption is that the 1.2.3 version has something you
             #  *don't* want, so we push the prerelease down to the minimum.
             if (self.operator == '<' and len(self.semver.prerelease) >= 0):
+                self.semver = copy.copy(self.semver)
                 self.semver.prerelease = ["0"]
                 self.semver.format()
                 logger.debug("Comparator.parse semver %s", self.semver)
@@ -655,6 +693,26 @@ class Comparator(object):
         else:
             return cmp(version, self.operator, self.semver, self.loose)
 
+    def bounds(self):
+        """Get the half-open interval of version points that pass.
+
+        See `version_point` for the ordering of the bounds.
+        """
+        if self.semver == ANY:
+            return (MIN_BOUND, MAX_BOUND)
+        key = self.semver.key
+        op = self.operator
+        if op == ">":
+            return ((key, 1), MAX_BOUND)
+        elif op == ">=":
+            return ((key, 0), MAX_BOUND)
+        elif op == "<":
+            return (MIN_BOUND, (key, 0))
+        elif op == "<=":
+            return (MIN_BOUND, (key, 1))
+        else:
+            return ((key, 0), (key, 1))
+
 
 def make_range(range_, loose):
     if isinstance(range_, Range) and range_.loose == loose:
@@ -662,10 +720,14 @@ def make_range(range_, loose):
 
     # if (!(this instanceof Range))
     #    return new Range(range, loose);
-    return Range(range_, loose)
+    if isinstance(range_, Range):
+        range_ = range_.raw
+    return _range_cache.get((range_, loose), Range)
 
 
 class Range(object):
+    _intervals = None
+
     def __init__(self, range_, loose):
         self.loose = loose
         #  First, split based on boolean or ||
@@ -730,10 +792,37 @@ class Range(object):
     def test(self, version):
         if version is None:  # xxx
             return False
-        for e in self.set:
-            if test_set(e, version):
-                return True
-        return False
+        intervals = self.compile()
+        point = version_point(version, self.loose)
+        i = bisect_right(intervals, (point, MAX_BOUND)) - 1
+        return i >= 0 and point < intervals[i][1]
+
+    def compile(self):
+        """Get the range as a sorted list of disjoint (low, high) intervals.
+
+        Each interval is half-open over the points of `version_point`.
+        """
+        if self._intervals is not None:
+            return self._intervals
+
+        intervals = []
+        for comparators in self.set:
+            low, high = MIN_BOUND, MAX_BOUND
+            for comp in comparators:
+                (comp_low, comp_high) = comp.bounds()
+                low = max(low, comp_low)
+                high = min(high, comp_high)
+            if low < high:
+                intervals.append((low, high))
+
+        merged = []
+        for (low, high) in sorted(intervals):
+            if merged and low <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+            else:
+                merged.append((low, high))
+        self._intervals = merged
+        return merged
 
 
 #  Mostly just for testing and legacy API reasons
@@ -982,18 +1071,116 @@ def satisfies(version, range_, loose):
     return range_.test(version)
 
 
+def satisfies_many(versions, range_, loose):
+    """Test a list of versions against a range.
+
+    Returns a list of booleans in the order of the versions.
+    """
+    try:
+        intervals = make_range(range_, loose).compile()
+    except Exception as e:
+        return [False] * len(versions)
+
+    points = _sorted_points(versions, loose)
+    keys = [point for (point, _) in points]
+    result = [False] * len(versions)
+    for (low, high) in intervals:
+        start = bisect_left(keys, low)
+        for (_, index) in points[start:bisect_left(keys, high)]:
+            result[index] = True
+    return result
+
+
 def max_satisfying(versions, range_, loose):
-    xs = [version for version in versions if satisfies(version, range_, loose)]
-    if len(xs) <= 0:
+    try:
+        intervals = make_range(range_, loose).compile()
+    except Exception as e:
         return None
-    selected = xs[0]
-    for x in xs[1:]:
-        try:
-            if rcompare(selected, x, loose) == 1:
-                selected = x
-        except ValueError:
-            logger.warn("{} is invalud version".format(x))
-    return selected
+
+    points = _sorted_points(versions, loose)
+    keys = [point for (point, _) in points]
+    for (low, high) in reversed(intervals):
+        i = bisect_left(keys, high) - 1
+        if i >= 0 and keys[i] >= low:
+            #  Prefer the first of equal versions.
+            return versions[points[bisect_left(keys, keys[i])][1]]
+    return None
+
+
+def intersects(range1, range2, loose):
+    """Test whether any version satisfies both ranges.
+    """
+    intervals1 = make_range(range1, loose).compile()
+    intervals2 = make_range(range2, loose).compile()
+    i = j = 0
+    while i < len(intervals1) and j < len(intervals2):
+        (low1, high1) = intervals1[i]
+        (low2, high2) = intervals2[j]
+        high = min(high1, high2)
+        if _first_point(max(low1, low2)) < high:
+            return True
+        if high1 <= high2:
+            i += 1
+        else:
+            j += 1
+    return False
+
+
+#  Bounds of the intervals in `Range.compile`.  A bound is a version key
+#  and a flag, where (key, 1) sorts just above the point of the version.
+MIN_BOUND = ((), 0)
+MAX_BOUND = ((float('inf'),), 0)
+
+
+_RELEASE_KEY = (1,)
+
+
+def version_key(version):
+    """Get a tuple key that sorts parsed versions by precedence.
+
+    A release sorts above its prereleases, and numeric prerelease
+    identifiers sort below alphanumeric ones.  Build metadata is ignored.
+    Parsed versions carry their key in `SemVer.key`.
+    """
+    if not version.prerelease:
+        pre = _RELEASE_KEY
+    else:
+        pre = (0,) + tuple(
+            (0, int(id)) if NUMERIC.search(str(id)) else (1, str(id))
+            for id in version.prerelease
+        )
+    return (version.major, version.minor, version.patch, pre)
+
+
+def version_point(version, loose):
+    """Get the point of a version in the intervals of `Range.compile`.
+    """
+    return (make_semver(version, loose).key, 0)
+
+
+def _first_point(bound):
+    """Get the lowest version point at or above a bound.
+    """
+    (key, flag) = bound
+    if not key:
+        return ((0, 0, 0, (0, (0, 0))), 0)
+    if not flag or key == MAX_BOUND[0]:
+        return bound
+    (major, minor, patch, pre) = key
+    if pre == _RELEASE_KEY:
+        #  The next version is the first prerelease of the next patch.
+        return ((major, minor, patch + 1, (0, (0, 0))), 0)
+    #  Appending an identifier gives the next prerelease.
+    return ((major, minor, patch, pre + ((0, 0),)), 0)
+
+
+def _sorted_points(versions, loose):
+    """Get the sorted (point, index) pairs of a list of versions.
+    """
+    return sorted(
+        (version_point(version, loose), index)
+        for (index, version) in enumerate(versions) if version is not None
+    )
 
 
 def valid_range(range_, loose):
@@ -95,6 +95,20 @@ QuantLabPlugin.prototype.apply = function(compiler) {
 };
 
 
+var plugins = [ new QuantLabPlugin({}) ];
+
+// Report the build progress on separate lines for the build handler.
+if (process.env.QUANTLAB_BUILD_PROGRESS) {
+  var lastPercent = -1;
+  plugins.push(new webpack.ProgressPlugin(function(percentage, message) {
+    var percent = Math.floor(percentage * 100);
+    if (percent !== lastPercent) {
+      lastPercent = percent;
+      console.log('[progress] ' + percent + '% ' + message);
+    }
+  }));
+}
+
 
 module.exports = {
   entry:  path.resolve(buildDir, 'index.out.js'),
@@ -151,5 +165,5 @@ module.exports = {
   },
   bail: true,
   devtool: 'cheap-source-map',
-  plugins: [ new QuantLabPlugin({}) ]
+  plugins: plugins
 }
@@ -0,0 +1,306 @@
+/*-----------------------------------------------------------------------------
+| Copyright (c) Jupyter Development Team.
+| Distributed under the terms of the Modified BSD License.
+|----------------------------------------------------------------------------*/
+
+/**
+ * A persistent worker that runs Node scripts such as yarn.js and npm-cli.js.
+ *
+ * Each task runs in its own worker thread with a fresh module state, so
+ * only the Node startup and the compilation of the script are shared.
+ * The compiled code of each script is cached and reused by later tasks.
+ *
+ * Worker threads share the working directory of the process and cannot
+ * change it, so the process changes to the directory of each task before
+ * it starts, and only tasks with the same directory run at once.  Relative
+ * paths and child processes of a task thus use its directory.  A task
+ * that calls `process.chdir` only changes its own `process.cwd()`.
+ *
+ * The child processes of a task start in their own process groups, which
+ * are signaled with the task thread when the task is canceled or the
+ * worker stops.  Children started with the sync functions like `execSync`
+ * block their task until they exit and are not tracked.
+ *
+ * Requests are JSON lines on stdin:
+ *
+ *   {"id": 1, "type": "run", "script": "...", "args": [...], "cwd": "...",
+ *    "env": {...}}
+ *   {"id": 2, "type": "ping"}
+ *   {"id": 1, "type": "cancel"}
+ *
+ * Responses are JSON lines on stdout after a NUL marker, interleaved with
+ * the output of child processes of the tasks:
+ *
+ *   {"id": 1, "type": "output", "data": "..."}
+ *   {"id": 1, "type": "exit", "code": 0}
+ *   {"id": 2, "type": "pong"}
+ *
+ * The worker exits when stdin is closed or after it has been idle for the
+ * number of seconds given as its first argument.
+ */
+'use strict';
+
+var fs = require('fs');
+var path = require('path');
+var vm = require('vm');
+var Module = require('module');
+var threads = require('worker_threads');
+
+var MARKER = '\u0000quantlab-worker ';
+
+// The time in ms between SIGTERM and SIGKILL for the children of a task.
+var KILL_TIMEOUT = 5000;
+
+
+/**
+ * Compile a script with the module wrapper, using cached code if given.
+ */
+function compile(filename, source, cachedData) {
+  return new vm.Script(Module.wrap(source), {
+    filename: filename,
+    cachedData: cachedData
+  });
+}
+
+
+/**
+ * Run the script of a task as the main module of this thread.
+ */
+function runTask(task) {
+  trackChildren();
+  var cwd = task.cwd;
+  process.cwd = function() { return cwd; };
+  process.chdir = function(dir) { cwd = path.resolve(cwd, dir); };
+  process.argv = [process.execPath, task.script].concat(task.args);
+
+  var script = compile(task.script, task.source, task.cachedData);
+  var mod = new Module(task.script, null);
+  mod.filename = task.script;
+  mod.paths = Module._nodeModulePaths(path.dirname(task.script));
+  var req = Module.createRequire(task.script);
+  req.main = mod;
+  script.runInThisContext().call(
+    mod.exports, mod.exports, req, mod, task.script,
+    path.dirname(task.script)
+  );
+}
+
+
+/**
+ * Report the child processes of this thread to the main thread.
+ *
+ * The children start in their own process groups, so that the groups can
+ * be signaled with their descendants.
+ */
+function trackChildren() {
+  var ChildProcess = require('child_process').ChildProcess;
+  var spawn = ChildProcess.prototype.spawn;
+  ChildProcess.prototype.spawn = function(options) {
+    if (process.platform !== 'win32') {
+      options.detached = true;
+    }
+    var result = spawn.call(this, options);
+    var pid = this.pid;
+    if (pid) {
+      threads.parentPort.postMessage({ type: 'child', pid: pid });
+      this.once('exit', function() {
+        threads.parentPort.postMessage({ type: 'child-exit', pid: pid });
+      });
+    }
+    return result;
+  };
+}
+
+
+/**
+ * Send a signal to the process groups of children, ignoring errors.
+ */
+function killChildren(children, signal) {
+  Object.keys(children).forEach(function(pid) {
+    try {
+      if (process.platform === 'win32') {
+        process.kill(Number(pid), signal);
+      } else {
+        process.kill(-Number(pid), signal);
+      }
+    } catch (err) {
+      // The group has exited.
+    }
+  });
+}
+
+
+/**
+ * Serve the requests of the parent process.
+ */
+function serve(idleTimeout) {
+  var scripts = Object.create(null);
+  var running = Object.create(null);
+  var queue = [];
+  var idleTimer = null;
+
+  function send(msg) {
+    fs.writeSync(1, MARKER + JSON.stringify(msg) + '\n');
+  }
+
+  function resetIdle() {
+    clearTimeout(idleTimer);
+    var idle = Object.keys(running).length === 0 && queue.length === 0;
+    if (idleTimeout > 0 && idle) {
+      idleTimer = setTimeout(function() { process.exit(0); }, idleTimeout);
+    }
+  }
+
+  function getScript(filename) {
+    var mtime = fs.statSync(filename).mtimeMs;
+    var entry = scripts[filename];
+    if (!entry || entry.mtime !== mtime) {
+      var source = fs.readFileSync(filename, 'utf8').replace(/^#!.*/, '');
+      var cachedData = compile(filename, source).createCachedData();
+      entry = scripts[filename] = {
+        mtime: mtime, source: source, cachedData: cachedData
+      };
+    }
+    return entry;
+  }
+
+  function start(msg) {
+    var entry = getScript(msg.script);
+    var worker = new threads.Worker(__filename, {
+      workerData: {
+        script: msg.script,
+        args: msg.args || [],
+        cwd: process.cwd(),
+        source: entry.source,
+        cachedData: entry.cachedData
+      },
+      env: msg.env || process.env,
+      stdout: true,
+      stderr: true
+    });
+    var task = running[msg.id] = { worker: worker, children: {} };
+    var pending = 3;
+    var code = 1;
+
+    function done() {
+      pending -= 1;
+      if (pending === 0) {
+        delete running[msg.id];
+        send({ id: msg.id, type: 'exit', code: code });
+        schedule();
+        resetIdle();
+      }
+    }
+
+    [worker.stdout, worker.stderr].forEach(function(stream) {
+      stream.setEncoding('utf8');
+      stream.on('data', function(data) {
+        send({ id: msg.id, type: 'output', data: data });
+      });
+      stream.on('end', done);
+    });
+    worker.on('error', function(err) {
+      send({ id: msg.id, type: 'output', data: String(err.stack) + '\n' });
+    });
+    worker.on('message', function(child) {
+      if (child.type === 'child') {
+        task.children[child.pid] = true;
+      } else if (child.type === 'child-exit') {
+        delete task.children[child.pid];
+      }
+    });
+    worker.on('exit', function(exitCode) {
+      code = exitCode;
+      done();
+    });
+  }
+
+  /**
+   * Stop a running task and its children.
+   */
+  function cancel(task) {
+    var children = task.children;
+    killChildren(children, 'SIGTERM');
+    setTimeout(function() {
+      killChildren(children, 'SIGKILL');
+    }, KILL_TIMEOUT).unref();
+    task.worker.terminate();
+  }
+
+  /**
+   * Signal the children of all of the running tasks and exit.
+   */
+  function stop() {
+    Object.keys(running).forEach(function(id) {
+      killChildren(running[id].children, 'SIGTERM');
+    });
+    process.exit(0);
+  }
+
+  /**
+   * Start the queued tasks in order while they share the directory of the
+   * running tasks.
+   */
+  function schedule() {
+    while (queue.length) {
+      var msg = queue[0];
+      var cwd = path.resolve(msg.cwd || process.cwd());
+      if (Object.keys(running).length && cwd !== process.cwd()) {
+        return;
+      }
+      queue.shift();
+      try {
+        process.chdir(cwd);
+        start(msg);
+      } catch (err) {
+        send({ id: msg.id, type: 'output', data: String(err.stack) + '\n' });
+        send({ id: msg.id, type: 'exit', code: 1 });
+      }
+    }
+  }
+
+  function handle(line) {
+    var msg = JSON.parse(line);
+    if (msg.type === 'ping') {
+      send({ id: msg.id, type: 'pong' });
+    } else if (msg.type === 'cancel') {
+      if (running[msg.id]) {
+        cancel(running[msg.id]);
+        return;
+      }
+      var queued = queue.filter(function(item) { return item.id === msg.id; });
+      if (queued.length) {
+        queue.splice(queue.indexOf(queued[0]), 1);
+        send({ id: msg.id, type: 'exit', code: 1 });
+        resetIdle();
+      }
+    } else if (msg.type === 'run') {
+      clearTimeout(idleTimer);
+      queue.push(msg);
+      schedule();
+      resetIdle();
+    }
+  }
+
+  var buffer = '';
+  process.stdin.setEncoding('utf8');
+  process.stdin.on('data', function(data) {
+    var lines = (buffer + data).split('\n');
+    buffer = lines.pop();
+    lines.forEach(function(line) {
+      if (line.trim()) {
+        handle(line);
+      }
+    });
+  });
+  process.stdin.on('end', stop);
+  process.on('SIGTERM', stop);
+  resetIdle();
+}
+
+
+if (threads.isMainThread) {
+  serve(parseFloat(process.argv[2] || '0') * 1000);
+} else {
+  runTask(threads.workerData);
+}
@@ -0,0 +1,181 @@
+# coding: utf-8
+"""Test the QuantLab build handlers"""
+
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+import json
+import logging
+import os
+from os.path import join as pjoin
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch  # py2
+
+from ipython_genutils import py3compat
+from ipython_genutils.tempdir import TemporaryDirectory
+from tornado import gen, web
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from quantlab import build_handler, commands
+from quantlab.build_handler import (
+    build_events_path, build_path, Builder, BuildEventsHandler, BuildHandler
+)
+from quantlab.commands import install_extension, link_package
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+class _TestHandler(object):
+    """A mixin that lets the test requests through."""
+
+    def get_current_user(self):
+        return 'user'
+
+    def check_xsrf_cookie(self):
+        pass
+
+
+class _BuildHandler(_TestHandler, BuildHandler):
+    pass
+
+
+class _BuildEventsHandler(_TestHandler, BuildEventsHandler):
+    pass
+
+
+def _parse_events(body):
+    """Parse the events of a server-sent event stream."""
+    events = []
+    for line in body.decode('utf-8').splitlines():
+        if line.startswith('data: '):
+            events.append(json.loads(line[len('data: '):]))
+    return events
+
+
+class TestBuildHandler(AsyncHTTPTestCase):
+
+    def tempdir(self):
+        td = TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        return py3compat.cast_unicode(td.name)
+
+    def setUp(self):
+        test_dir = self.tempdir()
+        p = patch.dict('os.environ', {
+            'JUPYTER_CONFIG_DIR': pjoin(test_dir, 'config'),
+            'JUPYTER_DATA_DIR': pjoin(test_dir, 'data'),
+            'QUANTLAB_DIR': pjoin(test_dir, 'quantlab'),
+            'QUANTLAB_SETTINGS_DIR': pjoin(test_dir, 'settings')
+        })
+        p.start()
+        self.addCleanup(p.stop)
+        super(TestBuildHandler, self).setUp()
+
+    def get_app(self):
+        self.app_dir = commands.get_app_dir()
+        self.builder = Builder(logging.getLogger('quantlab'), False,
+                               self.app_dir)
+        kwargs = dict(builder=self.builder)
+        return web.Application([
+            (build_events_path, _BuildEventsHandler, kwargs),
+            (build_path, _BuildHandler, kwargs)
+        ], cookie_secret='secret')
+
+    @gen.coroutine
+    def _connect(self):
+        """Open an event stream and wait until it listens."""
+        response = self.http_client.fetch(self.get_url(build_events_path))
+        while not self.builder._listeners:
+            yield gen.sleep(0.01)
+        raise gen.Return(response)
+
+    @gen_test(timeout=30)
+    def test_build_events(self):
+        def build(app_dir=None, logger=None, on_phase=None, **kwargs):
+            on_phase('staging')
+            logger.info('Staging done')
+            on_phase('webpack')
+            logger.info('[progress] 50% building modules')
+            logger.debug('Not published')
+            return []
+
+        with patch.object(build_handler, 'build', build):
+            stream = yield self._connect()
+            response = yield self.http_client.fetch(
+                self.get_url(build_path), method='POST', body='')
+            assert response.code == 202
+            # The stream ends with the build.
+            response = yield stream
+
+        events = _parse_events(response.body)
+        assert [e['type'] for e in events] == [
+            'status', 'phase', 'log', 'phase', 'progress', 'status'
+        ]
+        assert events[0]['status'] == 'building'
+        assert [events[1]['phase'], events[3]['phase']] == [
+            'staging', 'webpack'
+        ]
+        assert events[2]['message'] == 'Staging done'
+        assert events[4]['percent'] == 50
+        assert events[4]['message'] == 'building modules'
+        assert events[5]['status'] == 'stable'
+        assert not self.builder.building
+        assert not self.builder._listeners
+
+    @gen_test(timeout=30)
+    def test_build_events_failed(self):
+        def build(**kwargs):
+            raise ValueError('No webpack')
+
+        def clean(app_dir):
+            pass
+
+        with patch.object(build_handler, 'build', build), \
+                patch.object(build_handler, 'clean', clean):
+            stream = yield self._connect()
+            response = yield self.http_client.fetch(
+                self.get_url(build_path), method='POST', body='')
+            assert response.code == 202
+            response = yield stream
+
+        events = _parse_events(response.body)
+        assert events[-1]['status'] == 'failed'
+        assert events[-1]['message'] == 'No webpack'
+
+    def test_build_status(self):
+        checks = []
+
+        def build_check(app_dir=None, logger=None, priority=None):
+            checks.append(app_dir)
+            return []
+
+        def get_status():
+            response = self.fetch(build_path)
+            assert response.code == 200
+            assert json.loads(response.body.decode('utf-8')) == dict(
+                status='stable', message=''
+            )
+            return response
+
+        with patch.object(build_handler, 'build_check', build_check):
+            response = get_status()
+            get_status()
+            assert len(checks) == 1
+
+            # The check runs again when an input of the build changes.
+            install_extension(pjoin(here, 'mockextension'))
+            get_status()
+            assert len(checks) == 2
+            link_package(pjoin(here, 'mockpackage'))
+            get_status()
+            get_status()
+            assert len(checks) == 3
+
+            # Clients revalidate the status with its ETag.
+            etag = response.headers['Etag']
+            response = self.fetch(build_path,
+                                  headers={'If-None-Match': etag})
+            assert response.code == 304
+            assert len(checks) == 3
@@ -0,0 +1,353 @@
+# coding: utf-8
+"""Test the QuantLab build commands"""
+
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+import glob
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+from os.path import join as pjoin
+from unittest import TestCase
+import pytest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch  # py2
+
+from ipython_genutils import py3compat
+from ipython_genutils.tempdir import TemporaryDirectory
+
+from quantlab import commands
+from quantlab.commands import (
+    build, install_extension, link_package, list_extensions
+)
+from quantlab.packer import pack_directory
+from quantlab.resolver import check_lockfile
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestCommands(TestCase):
+
+    def tempdir(self):
+        td = TemporaryDirectory()
+        self.tempdirs.append(td)
+        return py3compat.cast_unicode(td.name)
+
+    def setUp(self):
+        # Any TemporaryDirectory objects appended to this list will be cleaned
+        # up at the end of the test run.
+        self.tempdirs = []
+
+        @self.addCleanup
+        def cleanup_tempdirs():
+            for d in self.tempdirs:
+                d.cleanup()
+
+        self.test_dir = self.tempdir()
+        self.source_dir = pjoin(here, 'mockextension')
+        self.incompat_dir = pjoin(here, 'mockextension-incompat')
+        self.mock_package = pjoin(here, 'mockpackage')
+        self.mime_renderer_dir = pjoin(here, 'mock-mimeextension')
+
+        p = patch.dict('os.environ', {
+            'JUPYTER_CONFIG_DIR': pjoin(self.test_dir, 'config'),
+            'JUPYTER_DATA_DIR': pjoin(self.test_dir, 'data'),
+            'QUANTLAB_DIR': pjoin(self.test_dir, 'quantlab'),
+            'QUANTLAB_SETTINGS_DIR': pjoin(self.test_dir, 'settings')
+        })
+        p.start()
+        self.addCleanup(p.stop)
+
+        self.app_dir = commands.get_app_dir()
+        self.assertEqual(self.app_dir,
+                         os.path.realpath(pjoin(self.test_dir, 'quantlab')))
+
+    def test_extension_index(self):
+        install_extension(self.source_dir)
+        list_extensions()
+        target = pjoin(self.app_dir, 'settings', 'extension_index.json')
+        with open(target) as fid:
+            index = json.load(fid)
+        path = pjoin(self.app_dir, 'extensions', '*python-tests*.tgz')
+        path = os.path.realpath(glob.glob(path)[0])
+        assert index[path]['data']['name'] == '@quantlab/python-tests'
+        assert index[path]['compat'] == []
+
+    def test_local_fingerprint(self):
+        install_extension(self.source_dir)
+        target = pjoin(self.app_dir, 'settings', 'local_fingerprints.json')
+        with open(target) as fid:
+            index = json.load(fid)
+        entry = index[os.path.realpath(self.source_dir)]
+        assert entry['fingerprint'] == commands._fingerprint(self.source_dir)
+        assert entry['filename'].startswith('quantlab-python-tests-0.1.0-')
+
+    def test_populate_staging_incremental(self):
+        link_package(self.mock_package)
+        handler = commands._AppHandler(self.app_dir)
+        handler._populate_staging()
+        staging = pjoin(self.app_dir, 'staging')
+        paths = glob.glob(pjoin(staging, '*'))
+        paths += glob.glob(pjoin(staging, 'linked_packages', '*'))
+        assert pjoin(staging, 'package.json') in paths
+
+        def get_stats():
+            return [(os.stat(p).st_ino, os.stat(p).st_mtime) for p in paths]
+
+        stats = get_stats()
+        handler = commands._AppHandler(self.app_dir)
+        handler._populate_staging()
+        assert get_stats() == stats
+
+    def test_build_cache(self):
+        calls = []
+
+        def run(handler, cmd, **kwargs):
+            calls.append(cmd)
+            static = pjoin(self.app_dir, 'static')
+            if not os.path.exists(static):
+                os.makedirs(static)
+            return 0
+
+        with patch.object(commands._AppHandler, '_run', run):
+            build()
+            assert len(calls) == 2
+            build()
+            assert len(calls) == 2
+        assert os.path.exists(pjoin(self.app_dir, 'static'))
+
+        with patch.dict('os.environ', {'QUANTLAB_BUILD_CACHE_SIZE': 'big'}):
+            size = commands._get_build_cache_size()
+        assert size == commands.DEFAULT_BUILD_CACHE_SIZE * 1024 * 1024
+
+    def test_build_cache_tarball(self):
+        calls = []
+
+        def run(handler, cmd, **kwargs):
+            calls.append(cmd)
+            return 0
+
+        source = pjoin(self.tempdir(), 'extension')
+        shutil.copytree(self.source_dir, source)
+        install_extension(pack_directory(source, self.tempdir()))
+        with patch.object(commands._AppHandler, '_run', run):
+            build()
+            count = len(calls)
+            build()
+            assert len(calls) == count
+
+        with open(pjoin(source, 'index.js'), 'a') as fid:
+            fid.write('\n// changed\n')
+        install_extension(pack_directory(source, self.tempdir()))
+        with patch.object(commands._AppHandler, '_run', run):
+            build()
+            assert len(calls) > count
+
+    def test_build_phases(self):
+        def run(handler, cmd, **kwargs):
+            return 0
+
+        phases = []
+        with patch.object(commands._AppHandler, '_run', run):
+            build(stream=True, on_phase=phases.append)
+        assert phases == ['staging', 'install', 'webpack']
+
+    def test_install_stamp(self):
+        calls = []
+
+        def run(handler, cmd, **kwargs):
+            calls.append(cmd[2])
+            modules = pjoin(self.app_dir, 'staging', 'node_modules')
+            if not os.path.exists(modules):
+                os.makedirs(modules)
+            return 0
+
+        source = pjoin(self.tempdir(), 'extension')
+        shutil.copytree(self.source_dir, source)
+        install_extension(pack_directory(source, self.tempdir()))
+
+        env = {'QUANTLAB_BUILD_CACHE_SIZE': '0'}
+        with patch.dict('os.environ', env):
+            with patch.object(commands._AppHandler, '_run', run):
+                build()
+                build()
+                assert calls == ['install', 'run', 'run']
+                build(force_install=True)
+                assert calls[-2:] == ['install', 'run']
+
+            # Reinstall the tarball with new contents.
+            with open(pjoin(source, 'index.js'), 'a') as fid:
+                fid.write('\n// changed\n')
+            install_extension(pack_directory(source, self.tempdir()))
+            with patch.object(commands._AppHandler, '_run', run):
+                build()
+                assert calls[-2:] == ['install', 'run']
+
+    def test_build_check_key(self):
+        key = commands.get_build_check_key()
+        assert commands.get_build_check_key() == key
+        install_extension(self.source_dir)
+        new_key = commands.get_build_check_key()
+        assert new_key != key
+
+        link_package(self.mock_package)
+        assert commands.get_build_check_key() != new_key
+
+    def test_core_data(self):
+        data = commands._get_core_data()
+        assert commands._get_core_data() is data
+        with pytest.raises(TypeError):
+            data['dependencies']['foo'] = '1.0'
+        copy = commands._thaw(data)
+        copy['dependencies']['foo'] = '1.0'
+        assert 'foo' not in data['dependencies']
+
+    def test_install_extensions(self):
+        def get_extensions():
+            return commands.get_app_info(self.app_dir)['extensions']
+
+        with pytest.raises(ValueError):
+            commands.install_extensions([self.source_dir, self.incompat_dir])
+        assert '@quantlab/python-tests' not in get_extensions()
+
+        commands.install_extensions([self.source_dir, self.mime_renderer_dir])
+        extensions = get_extensions()
+        assert '@quantlab/python-tests' in extensions
+        assert '@quantlab/mime-extension-test' in extensions
+
+        names = ['@quantlab/python-tests', '@quantlab/mime-extension-test']
+        assert commands.uninstall_extensions(names)
+        assert not get_extensions()
+
+    def test_config_store(self):
+        path = pjoin(self.tempdir(), 'config.json')
+        store = commands._ConfigStore(path)
+        with store.transaction() as config:
+            config['foo'] = 1
+            store.write(config)
+            assert not os.path.exists(path)
+        with open(path) as fid:
+            assert json.load(fid) == {'foo': 1}
+
+        with pytest.raises(ValueError):
+            with store.transaction() as config:
+                config['bar'] = 2
+                store.write(config)
+                raise ValueError('failed')
+        assert store.read() == {'foo': 1}
+
+    def test_pack_directory(self):
+        path = pack_directory(self.source_dir, self.tempdir())
+        assert os.path.basename(path) == 'quantlab-python-tests-0.1.0.tgz'
+        with tarfile.open(path) as tar:
+            names = tar.getnames()
+        assert names == ['package/index.js', 'package/package.json']
+
+    @pytest.mark.skipif(not commands.which('npm'), reason='needs npm')
+    def test_pack_directory_npm(self):
+        source = pjoin(self.tempdir(), 'extension')
+        shutil.copytree(self.source_dir, source)
+        with open(pjoin(source, 'package.json')) as fid:
+            data = json.load(fid)
+        data['bin'] = dict(python_tests='cli.js')
+        with open(pjoin(source, 'package.json'), 'w') as fid:
+            json.dump(data, fid)
+        with open(pjoin(source, 'cli.js'), 'w') as fid:
+            fid.write('#!/usr/bin/env node\n')
+        os.chmod(pjoin(source, 'cli.js'), 0o644)
+
+        path = pack_directory(source, self.tempdir())
+        npm_dir = self.tempdir()
+        subprocess.check_call([commands.which('npm'), 'pack', source],
+                              cwd=npm_dir)
+        npm_path = pjoin(npm_dir, os.path.basename(path))
+        with gzip.open(path) as fid, gzip.open(npm_path) as npm_fid:
+            assert fid.read() == npm_fid.read()
+        with tarfile.open(path) as tar:
+            assert tar.getmember('package/cli.js').mode == 0o755
+
+    def test_pack_lifecycle_scripts(self):
+        source = pjoin(self.tempdir(), 'extension')
+        shutil.copytree(self.source_dir, source)
+        with open(pjoin(source, 'package.json')) as fid:
+            data = json.load(fid)
+        data['scripts'] = dict(prepublish='tsc')
+        with open(pjoin(source, 'package.json'), 'w') as fid:
+            json.dump(data, fid)
+        assert pack_directory(source, self.tempdir()) is None
+
+        calls = []
+
+        def run(handler, cmd, **kwargs):
+            calls.append(cmd)
+            if cmd[1] == 'pack':
+                pack_directory(self.source_dir, kwargs['cwd'])
+                # The lifecycle scripts write into the source.
+                with open(pjoin(source, 'index.js'), 'w') as fid:
+                    fid.write('// built')
+            return 0
+
+        handler = commands._AppHandler(self.app_dir)
+        with patch.object(commands._AppHandler, '_run', run):
+            info = handler._extract_package(source, self.tempdir())
+        assert calls[0] == ['node', commands.YARN_PATH, 'install']
+        assert calls[1][1:] == ['pack', source]
+        assert info['name'] == '@quantlab/python-tests'
+        assert handler._get_fingerprinted(source) == info['filename']
+
+    def test_check_lockfile(self):
+        staging = self.tempdir()
+        pack_directory(self.source_dir, staging)
+        data = dict(dependencies={
+            '@quantlab/python-tests': 'file:quantlab-python-tests-0.1.0.tgz',
+            'left-pad': '^1.1.0',
+            'right-pad': '~1.0.0'
+        })
+        with open(pjoin(staging, 'package.json'), 'w') as fid:
+            json.dump(data, fid)
+        lock = """# yarn lockfile v1
+
+
+"@quantlab/python-tests@file:quantlab-python-tests-0.1.0.tgz":
+  version "0.1.0"
+
+left-pad@^1.1.0, left-pad@^1.2.0:
+  version "1.3.0"
+  resolved "https://registry.yarnpkg.com/left-pad/-/left-pad-1.3.0.tgz"
+  dependencies:
+    right-pad "^1.2.0"
+
+right-pad@^1.2.0:
+  version "1.2.1"
+"""
+        with open(pjoin(staging, 'yarn.lock'), 'w') as fid:
+            fid.write(lock)
+
+        result = check_lockfile(staging, ['right-pad'])
+        assert not result['satisfied']
+        assert result['unresolved'] == ['right-pad@~1.0.0']
+        assert result['conflicts'] == [('right-pad', '^1.2.0', '~1.0.0')]
+
+        data['dependencies']['right-pad'] = '^1.2.0'
+        with open(pjoin(staging, 'package.json'), 'w') as fid:
+            json.dump(data, fid)
+        result = check_lockfile(staging, ['right-pad'])
+        assert result['satisfied'] and not result['conflicts']
+
+        paths = []
+
+        def read_tarball(path):
+            paths.append(path)
+            return dict(name='@quantlab/python-tests', version='0.1.0')
+
+        result = check_lockfile(staging, ['right-pad'], read_tarball)
+        assert result['satisfied']
+        assert paths == [
+            os.path.join(staging, 'quantlab-python-tests-0.1.0.tgz')
+        ]
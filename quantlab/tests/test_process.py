@@ -0,0 +1,200 @@
+# coding: utf-8
+"""Test the process helpers"""
+
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from threading import Thread
+from unittest import TestCase
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from quantlab.process import (
+    AsyncProcess, DEFAULT_PROCESS_MEMORY, PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE, Process, Scheduler, format_stats
+)
+
+
+class TestProcess(TestCase):
+
+    def test_scheduler(self):
+        scheduler = Scheduler(slots=1)
+        running = scheduler.acquire(['node', 'yarn.js', 'build'], group='a')
+        started = []
+
+        def run(group, priority):
+            ticket = scheduler.acquire(['npm', 'pack'], group=group,
+                                       priority=priority)
+            started.append(group)
+            scheduler.release(ticket)
+
+        threads = []
+        for args in [('a', PRIORITY_BACKGROUND), ('a', PRIORITY_BACKGROUND),
+                     ('b', PRIORITY_BACKGROUND), ('c', PRIORITY_INTERACTIVE)]:
+            threads.append(Thread(target=run, args=args))
+            threads[-1].start()
+            while len(scheduler.status()['queued']) < len(threads):
+                time.sleep(0.01)
+
+        assert scheduler.get_position('c') == 1
+        assert scheduler.get_position('b') == 2
+        assert scheduler.get_position('a') == 3
+
+        scheduler.release(running, dict(max_rss=1024))
+        for thread in threads:
+            thread.join()
+        assert started == ['c', 'b', 'a', 'a']
+        assert scheduler.get_position('a') is None
+
+        ticket = scheduler.acquire(['node', 'yarn.js', 'build'])
+        assert ticket['memory'] == 1024
+        scheduler.release(ticket)
+
+    def test_scheduler_lock_dir(self):
+        lock_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, lock_dir, True)
+        first = Scheduler(slots=1, lock_dir=lock_dir)
+        second = Scheduler(slots=1, lock_dir=lock_dir)
+        ticket = first.acquire(['node', 'yarn.js', 'build'])
+        started = []
+
+        def run():
+            started.append(second.acquire(['npm', 'pack']))
+
+        thread = Thread(target=run)
+        thread.start()
+        time.sleep(0.3)
+        # The slot of the host is taken by the other scheduler.
+        assert not started
+        first.release(ticket)
+        thread.join(5)
+        assert started
+        second.release(started[0])
+
+    def test_scheduler_async(self):
+        scheduler = Scheduler(slots=1, memory=1024)
+        watch = scheduler.acquire(['node', 'yarn.js', 'watch'])
+        watch['memory'] = 512
+
+        @gen.coroutine
+        def run():
+            future = scheduler.acquire_async(['node', 'yarn.js', 'build'])
+            yield gen.sleep(0.1)
+            assert not future.done()
+            assert scheduler.get_position() == 1
+
+            # An idle watch gives back its slot and keeps its memory.
+            scheduler.idle(watch)
+            ticket = yield gen.with_timeout(timedelta(seconds=5), future)
+            assert scheduler.status()['running'][0]['idle']
+            assert ticket['memory'] == DEFAULT_PROCESS_MEMORY
+
+            # The build takes the only slot.
+            future = scheduler.acquire_async(['npm', 'pack'])
+            yield gen.sleep(0.1)
+            assert not future.done()
+            scheduler.release(ticket)
+            ticket = yield gen.with_timeout(timedelta(seconds=5), future)
+            scheduler.release(ticket)
+
+        IOLoop.current().run_sync(run)
+        scheduler.release(watch)
+
+    def test_async_process(self):
+        received = []
+        code = 'import sys; print("out"); sys.stderr.write("err\\n")'
+        proc = AsyncProcess([sys.executable, '-c', code],
+                            sinks=[lambda *args: received.append(args)])
+        assert IOLoop.current().run_sync(proc.wait_async) == 0
+        assert sorted(received) == [('stderr', 'err'), ('stdout', 'out')]
+        assert proc.stats['returncode'] == 0
+        assert proc.stats['cpu_time'] is not None
+        assert proc.stats['max_rss'] > 0
+
+    def test_async_process_backpressure(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir, True)
+        marker = os.path.join(tempdir, 'done')
+        code = ('for i in range(100000): print(i)\n'
+                'open(%r, "w").close()' % marker)
+        lines = []
+        held = Future()
+
+        def sink(name, line):
+            lines.append(line)
+            if len(lines) == 1:
+                return held
+
+        @gen.coroutine
+        def run():
+            proc = AsyncProcess([sys.executable, '-c', code], sinks=[sink])
+            future = proc.wait_async()
+            yield gen.sleep(0.5)
+            # The full pipe blocks the process while the sink holds reads.
+            assert len(lines) == 1
+            assert not os.path.exists(marker)
+            held.set_result(None)
+            returncode = yield future
+            assert returncode == 0
+            assert len(lines) == 100000
+            assert os.path.exists(marker)
+
+        IOLoop.current().run_sync(run, timeout=30)
+
+    def test_process_stats(self):
+        code = 'import time; sum(range(10 ** 6)); time.sleep(0.2)'
+        proc = Process([sys.executable, '-c', code])
+        assert proc.wait() == 0
+        stats = proc.stats
+        assert stats['returncode'] == 0
+        assert stats['wall_time'] >= 0.2
+        assert stats['cpu_time'] == stats['user_time'] + stats['system_time']
+        assert 0 < stats['cpu_time'] < stats['wall_time'] + 1
+        assert stats['max_rss'] > 0
+
+        proc = Process([sys.executable, '-c', 'import sys; sys.exit(3)'])
+        assert proc.wait() == 3
+        assert proc.stats['returncode'] == 3
+
+    def test_format_stats(self):
+        records = [
+            dict(cmd='node yarn.js install', returncode=0, wall_time=12.34,
+                 cpu_time=8.0, max_rss=300e6),
+            dict(cmd='x' * 60, returncode=1, wall_time=1.0, cpu_time=None,
+                 max_rss=None)
+        ]
+        lines = format_stats(records).splitlines()
+        assert lines[0].split() == ['Command', 'Exit', 'Wall', '(s)', 'CPU',
+                                    '(s)', 'Peak', 'RSS', '(MB)']
+        assert lines[1].split() == ['node', 'yarn.js', 'install', '0',
+                                    '12.3', '8.0', '300']
+        assert lines[2].split() == ['x' * 47 + '...', '1', '1.0', '-', '-']
+        assert lines[3].split() == ['Total', '13.3', '8.0']
+        assert len(set(len(line) for line in lines[:3])) == 1
+
+    def test_process_waiters(self):
+        code = 'import sys, time; time.sleep(0.3); sys.exit(5)'
+        proc = Process([sys.executable, '-c', code])
+        results = []
+        threads = [Thread(target=lambda: results.append(proc.wait()))
+                   for i in range(2)]
+        for thread in threads:
+            thread.start()
+        results.append(IOLoop.current().run_sync(proc.wait_async))
+        for thread in threads:
+            thread.join()
+        assert results == [5, 5, 5]
+        # The wait thread reaped the process.
+        self.assertRaises(OSError, os.waitpid, proc.proc.pid, os.WNOHANG)
+
+        proc = Process(['sleep', '10'])
+        assert proc.terminate() == -signal.SIGTERM
+        assert proc.stats['returncode'] == -signal.SIGTERM
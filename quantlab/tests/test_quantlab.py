@@ -349,5 +349,5 @@ class TestExtension(TestCase):
         assert not _test_overlap('^0.5.0', '^0.6.0')
         assert not _test_overlap('~1.5.0', '^1.6.0')
 
-        assert _test_overlap('*', '0.6') is None
-        assert _test_overlap('<0.6', '0.1') is None
+        assert _test_overlap('*', '0.6')
+        assert _test_overlap('<0.6', '0.1')
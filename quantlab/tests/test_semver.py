@@ -0,0 +1,51 @@
+# coding: utf-8
+"""Test the semver implementation"""
+
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+from unittest import TestCase
+
+from quantlab import semver
+
+
+class TestSemver(TestCase):
+
+    def test_intervals(self):
+        versions = ['0.5.1', '1.2.3-beta', '1.2.3', '1.4.0', '2.0.0']
+        assert semver.satisfies_many(versions, '^1.2.3-alpha || 0.5', True) == [
+            True, True, True, True, False
+        ]
+        assert semver.max_satisfying(versions, '<1.4.0 || >=3', True) == '1.2.3'
+        assert semver.max_satisfying(versions, '>2.0.0', True) is None
+
+    def test_intersects(self):
+        assert semver.intersects('^0.5.0', '>=0.5.3 <0.6', True)
+        assert semver.intersects('*', '0.6', True)
+        assert semver.intersects('<0.6', '0.1', True)
+        assert semver.intersects('^0.5.0 || ^0.6.0', '>=0.6.2 <1', True)
+        assert semver.intersects('^0.6.0-beta.1', '0.6.0-beta.2', True)
+
+        assert not semver.intersects('^0.5.0', '^0.6.0', True)
+        assert not semver.intersects('~1.5.0', '^1.6.0', True)
+        assert not semver.intersects('<0.6', '0.6.0-alpha', True)
+        assert not semver.intersects('^0.4.0 || ~0.5.0', '^0.6.0 || ^1.0.0',
+                                     True)
+        assert not semver.intersects('>0.6.0 <0.6.1-0', '*', True)
+
+    def test_sort(self):
+        versions = ['1.0.0', '1.0.0-rc.1', '1.0.0-beta.11', '1.0.0-beta.2',
+                    '1.0.0-beta', '1.0.0-alpha.beta', '1.0.0-alpha.1',
+                    '1.0.0-alpha', '0.9.9+build.1']
+        assert semver.sort(list(versions), True) == versions[::-1]
+        assert semver.rsort(list(versions), True) == versions
+        assert semver.gt('1.0.0-alpha.beta', '1.0.0-alpha.1', True)
+        assert semver.eq('1.0.0+build.2', '1.0.0', True)
+
+    def test_inc(self):
+        version = semver.make_semver('1.2.3', True)
+        assert version.inc('major').version == '2.0.0'
+        assert version.inc('prerelease').version == '1.2.4-0'
+        assert semver.make_semver('1.2.3', True).version == '1.2.3'
+        assert semver.make_semver('1.2.3', True) is version
+        assert semver.inc('1.2.3-beta.1', 'prerelease', True) == '1.2.3-beta.2'
+        assert semver.make_semver('1.2.3-beta.1', True).version == '1.2.3-beta.1'